@@ -1,9 +1,14 @@
 """
 DSPy optimization for NL→SQL module using BootstrapFewShot
 """
+import hashlib
+import json
+import re
 import dspy
-from typing import List, Tuple
-from agent.dspy_signatures import NLToSQLModule
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
+from agent.dspy_signatures import NLToSQLModule, _serialize_constraints, _strip_fence, make_generate_sql
 from agent.tools import SQLiteTool
 
 
@@ -12,6 +17,18 @@ class SQLValidationMetric:
 
     def __init__(self, db_tool: SQLiteTool):
         self.db_tool = db_tool
+        # Same SQL recurs across eval passes and bootstrap rounds, so cache
+        # the outcome of validating + executing each distinct query
+        self._check_sql = lru_cache(maxsize=512)(self._run_sql)
+
+    def _run_sql(self, sql: str) -> Tuple[bool, bool, bool]:
+        """Validate and execute SQL, returning (is_valid, success, has_data)"""
+        is_valid, error = self.db_tool.validate_query(sql)
+        if not is_valid:
+            return False, False, False
+
+        result = self.db_tool.execute_query(sql)
+        return True, result["success"], bool(result["data"])
 
     def __call__(self, example, prediction, trace=None) -> float:
         """
@@ -25,25 +42,19 @@ class SQLValidationMetric:
         try:
             sql = prediction.sql_query if hasattr(prediction, 'sql_query') else str(prediction)
 
-            # Clean SQL
-            sql = sql.strip()
-            if "```sql" in sql:
-                sql = sql.split("```sql")[1].split("```")[0].strip()
-            elif "```" in sql:
-                sql = sql.split("```")[1].split("```")[0].strip()
+            # Clean SQL (NLToSQLModule output is already clean)
+            if not getattr(prediction, "cleaned", False):
+                sql = _strip_fence(sql)
 
-            # Validate syntax
-            is_valid, error = self.db_tool.validate_query(sql)
+            # Validate syntax and try to execute
+            is_valid, success, has_data = self._check_sql(sql)
 
             if not is_valid:
                 return 0.0
 
-            # Try to execute
-            result = self.db_tool.execute_query(sql)
-
-            if result["success"]:
+            if success:
                 # Check if we got data
-                if result["data"]:
+                if has_data:
                     return 1.0
                 else:
                     return 0.8  # Valid but no results
@@ -54,74 +65,60 @@ class SQLValidationMetric:
             return 0.0
 
 
-def create_training_examples(schema: str) -> List[dspy.Example]:
-    """
-    Create training examples for NL→SQL optimization
+# Schema lines like `Orders(OrderID, CustomerID...)` or `"Order Details"(...)`
+_TABLE_LINE_RE = re.compile(r'(?:\w+|"[\w ]+")\(')
 
-    These are hand-crafted examples that represent common query patterns
-    in the Northwind database
-    """
-    examples = [
-        dspy.Example(
-            question="What are the top 3 products by revenue?",
-            schema=schema,
-            constraints="{}",
-            sql_query="""SELECT p.ProductName, SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS Revenue
+# (question, constraints, sql_query) for each hand-crafted training example
+_EXAMPLES_TEMPLATE = (
+    (
+        "What are the top 3 products by revenue?",
+        {},
+        """SELECT p.ProductName, SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS Revenue
 FROM Products p
 JOIN "Order Details" od ON p.ProductID = od.ProductID
 GROUP BY p.ProductName
 ORDER BY Revenue DESC
 LIMIT 3"""
-        ).with_inputs("question", "schema", "constraints"),
-
-        dspy.Example(
-            question="How many orders were placed in June 1997?",
-            schema=schema,
-            constraints='{"date_range": {"start": "1997-06-01", "end": "1997-06-30"}}',
-            sql_query="""SELECT COUNT(DISTINCT OrderID) AS OrderCount
+    ),
+    (
+        "How many orders were placed in June 1997?",
+        {"date_range": {"start": "1997-06-01", "end": "1997-06-30"}},
+        """SELECT COUNT(DISTINCT OrderID) AS OrderCount
 FROM Orders
 WHERE OrderDate BETWEEN '1997-06-01' AND '1997-06-30'"""
-        ).with_inputs("question", "schema", "constraints"),
-
-        dspy.Example(
-            question="What was the total revenue from Beverages category?",
-            schema=schema,
-            constraints='{"categories": ["Beverages"]}',
-            sql_query="""SELECT SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS Revenue
+    ),
+    (
+        "What was the total revenue from Beverages category?",
+        {"categories": ["Beverages"]},
+        """SELECT SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS Revenue
 FROM "Order Details" od
 JOIN Products p ON od.ProductID = p.ProductID
 JOIN Categories c ON p.CategoryID = c.CategoryID
 WHERE c.CategoryName = 'Beverages'"""
-        ).with_inputs("question", "schema", "constraints"),
-
-        dspy.Example(
-            question="Which category had the highest quantity sold?",
-            schema=schema,
-            constraints="{}",
-            sql_query="""SELECT c.CategoryName, SUM(od.Quantity) AS TotalQuantity
+    ),
+    (
+        "Which category had the highest quantity sold?",
+        {},
+        """SELECT c.CategoryName, SUM(od.Quantity) AS TotalQuantity
 FROM "Order Details" od
 JOIN Products p ON od.ProductID = p.ProductID
 JOIN Categories c ON p.CategoryID = c.CategoryID
 GROUP BY c.CategoryName
 ORDER BY TotalQuantity DESC
 LIMIT 1"""
-        ).with_inputs("question", "schema", "constraints"),
-
-        dspy.Example(
-            question="What is the average order value in December 1997?",
-            schema=schema,
-            constraints='{"date_range": {"start": "1997-12-01", "end": "1997-12-31"}, "kpi_formula": "AOV"}',
-            sql_query="""SELECT SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID) AS AOV
+    ),
+    (
+        "What is the average order value in December 1997?",
+        {"date_range": {"start": "1997-12-01", "end": "1997-12-31"}, "kpi_formula": "AOV"},
+        """SELECT SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID) AS AOV
 FROM Orders o
 JOIN "Order Details" od ON o.OrderID = od.OrderID
 WHERE o.OrderDate BETWEEN '1997-12-01' AND '1997-12-31'"""
-        ).with_inputs("question", "schema", "constraints"),
-
-        dspy.Example(
-            question="Who is the top customer by total revenue in 1997?",
-            schema=schema,
-            constraints='{"date_range": {"start": "1997-01-01", "end": "1997-12-31"}}',
-            sql_query="""SELECT c.CompanyName, SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS Revenue
+    ),
+    (
+        "Who is the top customer by total revenue in 1997?",
+        {"date_range": {"start": "1997-01-01", "end": "1997-12-31"}},
+        """SELECT c.CompanyName, SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS Revenue
 FROM Customers c
 JOIN Orders o ON c.CustomerID = o.CustomerID
 JOIN "Order Details" od ON o.OrderID = od.OrderID
@@ -129,44 +126,162 @@ WHERE o.OrderDate BETWEEN '1997-01-01' AND '1997-12-31'
 GROUP BY c.CompanyName
 ORDER BY Revenue DESC
 LIMIT 1"""
-        ).with_inputs("question", "schema", "constraints"),
+    ),
 
-        # Additional examples for better coverage
-        dspy.Example(
-            question="Total revenue from Beverages in June 1997",
-            schema=schema,
-            constraints='{"date_range": {"start": "1997-06-01", "end": "1997-06-30"}, "categories": ["Beverages"]}',
-            sql_query="""SELECT SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS Revenue
+    # Additional examples for better coverage
+    (
+        "Total revenue from Beverages in June 1997",
+        {"date_range": {"start": "1997-06-01", "end": "1997-06-30"}, "categories": ["Beverages"]},
+        """SELECT SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS Revenue
 FROM Orders o
 JOIN "Order Details" od ON o.OrderID = od.OrderID
 JOIN Products p ON od.ProductID = p.ProductID
 JOIN Categories c ON p.CategoryID = c.CategoryID
 WHERE o.OrderDate BETWEEN '1997-06-01' AND '1997-06-30'
 AND c.CategoryName = 'Beverages'"""
-        ).with_inputs("question", "schema", "constraints"),
-
-        dspy.Example(
-            question="List all products in the Beverages category",
-            schema=schema,
-            constraints='{"categories": ["Beverages"]}',
-            sql_query="""SELECT p.ProductName
+    ),
+    (
+        "List all products in the Beverages category",
+        {"categories": ["Beverages"]},
+        """SELECT p.ProductName
 FROM Products p
 JOIN Categories c ON p.CategoryID = c.CategoryID
 WHERE c.CategoryName = 'Beverages'"""
-        ).with_inputs("question", "schema", "constraints"),
-    ]
+    ),
+)
 
-    return examples
+
+def _compact_schema(schema: str) -> str:
+    """Keep only the Table(col, ...) lines of a schema string"""
+    return "\n".join(line for line in schema.splitlines() if _TABLE_LINE_RE.match(line))
+
+
+@lru_cache(maxsize=8)
+def _build_examples(schema: str) -> Tuple[dspy.Example, ...]:
+    """Materialize the example templates for a given schema (cached per schema)"""
+    return tuple(
+        dspy.Example(
+            question=question,
+            schema=schema,
+            constraints=_serialize_constraints(constraints),
+            sql_query=sql_query
+        ).with_inputs("question", "schema", "constraints")
+        for question, constraints, sql_query in _EXAMPLES_TEMPLATE
+    )
+
+
+def create_training_examples(schema: str) -> List[dspy.Example]:
+    """
+    Create training examples for NL→SQL optimization
+
+    These are hand-crafted examples that represent common query patterns
+    in the Northwind database
+    """
+    # Copies, so callers (and optimizers) mutating an example don't change the cache
+    return [example.copy() for example in _build_examples(schema)]
+
+
+def _evaluate(module: NLToSQLModule, trainset: List[dspy.Example], metric: SQLValidationMetric) -> List[float]:
+    """
+    Score a module on the trainset
+
+    The LLM calls are blocking round-trips, so the whole trainset is submitted
+    as one dspy.Parallel batch; scoring then runs over the resolved
+    predictions in order.
+    """
+    runner = dspy.Parallel(
+        num_threads=max(1, len(trainset)),
+        # Parallel cancels once errors reach max_errors; stay above the trainset
+        # size so failures (e.g. an LM outage) just score 0.0
+        max_errors=len(trainset) + 1
+    )
+    # Examples carry with_inputs(question, schema, constraints)
+    predictions = runner([(module, example) for example in trainset])
+
+    scores = []
+    append = scores.append  # bound once for the loop
+    for example, pred in zip(trainset, predictions):
+        question = example.question
+        if pred is None:
+            # dspy.Parallel logs the underlying exception
+            print(f"Error: no prediction for {question[:50]}...")
+            append(0.0)
+            continue
+        score = metric(example, pred)
+        append(score)
+        print(f"Example: {question[:50]}... Score: {score}")
+
+    return scores
+
+
+def _program_cache_path(
+    cache_dir: str,
+    lm: dspy.LM,
+    module: NLToSQLModule,
+    schema: str,
+    trainset: List[dspy.Example]
+) -> Path:
+    """Where a compiled NL→SQL program for these inputs is saved"""
+    signature = module.generate.predict.signature
+    parts = [
+        getattr(lm, "model", ""),
+        signature.instructions,
+        json.dumps(list(signature.fields)),
+        schema,
+        json.dumps([dict(example) for example in trainset], sort_keys=True, default=str),
+    ]
+    h = hashlib.sha256()
+    for part in parts:
+        data = part.encode("utf-8")
+        h.update(len(data).to_bytes(8, "big"))
+        h.update(data)
+    return Path(cache_dir) / h.hexdigest()[:16] / "nl_to_sql.json"
+
+
+def _compile(
+    student: NLToSQLModule,
+    trainset: List[dspy.Example],
+    metric: SQLValidationMetric
+) -> NLToSQLModule:
+    """Run BootstrapFewShot on the student"""
+    optimizer = dspy.BootstrapFewShot(
+        metric=metric,
+        max_bootstrapped_demos=4,
+        max_labeled_demos=4
+    )
+
+    compiled = optimizer.compile(
+        student=student,
+        trainset=trainset
+    )
+
+    # Bootstrapping ran on the full schema (as inference does); only the stored
+    # demos are shrunk to a table digest, since the live query carries the full one
+    for predictor in compiled.predictors():
+        predictor.demos = [
+            demo.copy(schema=_compact_schema(demo.schema)) if "schema" in demo else demo
+            for demo in predictor.demos
+        ]
+
+    return compiled
 
 
 def optimize_nl_to_sql(
     db_tool: SQLiteTool,
     lm: dspy.LM,
-    num_examples: int = 8
+    num_examples: int = 8,
+    cache_dir: Optional[str] = ".dspy_cache"
 ) -> Tuple[NLToSQLModule, NLToSQLModule, dict]:
     """
     Optimize the NL→SQL module using BootstrapFewShot
 
+    The same `lm` is used for the baseline, bootstrap and optimized passes so
+    that a provider with prompt caching can reuse the shared schema prefix.
+
+    The compiled program is saved under `cache_dir`, keyed by the LM, the
+    signature, the schema and the trainset; later runs with the same key load
+    it instead of re-running BootstrapFewShot. Pass cache_dir=None to disable.
+
     Returns:
         (unoptimized_module, optimized_module, metrics_dict)
     """
@@ -183,43 +298,38 @@ def optimize_nl_to_sql(
     metric = SQLValidationMetric(db_tool)
 
     # Create modules
-    unoptimized = NLToSQLModule()
-    optimized = NLToSQLModule()
+    unoptimized = NLToSQLModule(make_generate_sql())
+    optimized = NLToSQLModule(make_generate_sql())
 
     # Measure baseline performance
     print("\n=== Evaluating Baseline (Unoptimized) ===")
-    baseline_scores = []
-    for example in trainset:
-        try:
-            pred = unoptimized(
-                question=example.question,
-                schema=example.schema,
-                constraints=example.constraints
-            )
-            score = metric(example, type('Pred', (), {'sql_query': pred})())
-            baseline_scores.append(score)
-            print(f"Example: {example.question[:50]}... Score: {score}")
-        except Exception as e:
-            print(f"Error: {e}")
-            baseline_scores.append(0.0)
+    baseline_scores = _evaluate(unoptimized, trainset, metric)
 
     baseline_avg = sum(baseline_scores) / len(baseline_scores) if baseline_scores else 0.0
     print(f"\nBaseline Average Score: {baseline_avg:.2f}")
 
+    cache_path = _program_cache_path(cache_dir, lm, optimized, schema, trainset) if cache_dir else None
+
     # Optimize using BootstrapFewShot
     print("\n=== Optimizing with BootstrapFewShot ===")
+    loaded = False
+    if cache_path is not None and cache_path.exists():
+        try:
+            optimized.load(str(cache_path))
+            loaded = True
+            print(f"Loaded compiled program from {cache_path}")
+        except Exception as e:
+            # Corrupt or incompatible file: recompile below and overwrite it
+            print(f"Ignoring cached program {cache_path}: {e}")
+            optimized = NLToSQLModule(make_generate_sql())
+
     try:
-        optimizer = dspy.BootstrapFewShot(
-            metric=metric,
-            max_bootstrapped_demos=4,
-            max_labeled_demos=4
-        )
-
-        optimized = optimizer.compile(
-            student=optimized,
-            trainset=trainset
-        )
-        print("Optimization completed successfully!")
+        if not loaded:
+            optimized = _compile(optimized, trainset, metric)
+            print("Optimization completed successfully!")
+            if cache_path is not None:
+                cache_path.parent.mkdir(parents=True, exist_ok=True)
+                optimized.save(str(cache_path))
 
     except Exception as e:
         print(f"Optimization warning: {e}")
@@ -228,20 +338,12 @@ def optimize_nl_to_sql(
 
     # Measure optimized performance
     print("\n=== Evaluating Optimized Module ===")
-    optimized_scores = []
-    for example in trainset:
-        try:
-            pred = optimized(
-                question=example.question,
-                schema=example.schema,
-                constraints=example.constraints
-            )
-            score = metric(example, type('Pred', (), {'sql_query': pred})())
-            optimized_scores.append(score)
-            print(f"Example: {example.question[:50]}... Score: {score}")
-        except Exception as e:
-            print(f"Error: {e}")
-            optimized_scores.append(0.0)
+    if optimized is unoptimized:
+        # Fallback module is the baseline itself; re-scoring would just repeat its LLM calls
+        print("Reusing baseline scores for fallback module")
+        optimized_scores = baseline_scores[:]
+    else:
+        optimized_scores = _evaluate(optimized, trainset, metric)
 
     optimized_avg = sum(optimized_scores) / len(optimized_scores) if optimized_scores else 0.0
     print(f"\nOptimized Average Score: {optimized_avg:.2f}")
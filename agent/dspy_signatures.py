@@ -1,11 +1,208 @@
 """
 DSPy signatures and modules for the hybrid agent
 """
+import copy
+import hashlib
+import json
+import re
+import threading
 import dspy
-from typing import List, Optional
+from collections import OrderedDict, namedtuple
+from functools import lru_cache, partial
+from itertools import islice
+from typing import Callable, Dict, Optional, Tuple, Type
+
+try:
+    import orjson  # optional: C-backed JSON parsing
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+# Markdown code fences around generated SQL, most specific first: a ```sql
+# block wins over an earlier bare fence
+_FENCES = ("```sql", "```")
+
+
+def _strip_fence(sql: str) -> str:
+    """Extract SQL from a markdown code block if present (closing fence optional)"""
+    sql = sql.strip()
+    for fence in _FENCES:
+        if fence in sql:
+            # Text after the first opening fence, up to the next fence of any kind
+            return sql.split(fence, 2)[1].split("```", 1)[0].strip()
+    return sql
+
+
+# First two sentences of a longer explanation (split on ". ")
+_TWO_SENTENCES_RE = re.compile(r"(.*?\. .*?)\. ", re.DOTALL)
+
+# Keywords the planner falls back on when constraints aren't valid JSON
+_CONSTRAINT_HINTS_RE = re.compile(
+    r"(?P<jun97>1997-06|june 1997)"
+    r"|(?P<dec97>1997-12|december 1997)"
+    r"|(?P<aov>aov|average order value)"
+    r"|(?P<margin>margin)",
+    re.IGNORECASE
+)
+
+# Router output keywords -> canonical route, checked in priority order
+_ROUTE_KEYWORDS = (
+    ("hybrid", "hybrid"),
+    ("both", "hybrid"),
+    ("sql", "sql"),
+    ("rag", "rag"),
+)
+
+
+# ==================== SQL Post-processing Patterns ====================
+
+# Literal typos the model makes, fixed in a single pass
+_SQL_TYPOS = {
+    "strftForms": "strftime",
+    "strftTime": "strftime",
+    "BETWEWEN": "BETWEEN",
+    "BETWEInstance": "BETWEEN",
+    "`Order Details`": '"Order Details"',
+}
+
+
+def _typo_fixer(typos: dict):
+    """Build a one-pass replacer for literal typo -> fix pairs"""
+    # Longest first so overlapping needles prefer the full match
+    pattern = re.compile("|".join(re.escape(typo) for typo in sorted(typos, key=len, reverse=True)))
+    return lambda sql: pattern.sub(lambda m: typos[m.group(0)], sql)
+
+
+_fix_sql_typos = _typo_fixer(_SQL_TYPOS)
+# Repair also rewrites bare OrderDetails (NL→SQL handles it with a word-boundary regex)
+_fix_repair_typos = _typo_fixer({**_SQL_TYPOS, "OrderDetails": '"Order Details"'})
+
+# OrderDetails / order_details (any case) → "Order Details"
+_RE_ORDERDETAILS = re.compile(r'\b(?:OrderDetails|(?i:order_details))\b')
+
+# Gibberish date operands like "o- 'Instance'" or "o-'0'"
+_RE_GIBBERISH_DATE = re.compile(r"[a-z]-\s*'(?:Instance|0)'")
+
+# Standalone Instance (model typed Instance instead of 0)
+_RE_INSTANCE = re.compile(r'\bInstance\b')
+
+# strftime('%Y-%m', col) BETWEEN 'YYYY-MM-DD' AND '...'
+_RE_MONTH_BETWEEN = re.compile(
+    r"strftime\('%Y-%m',\s*([^)]+)\)\s+BETWEEN\s+'(\d{4})-(\d{2})-\d{2}'\s+AND\s+'[^']+?'",
+    re.IGNORECASE
+)
+
+# Campaign names mistaken for customer / category filters
+_RE_CAMPAIGN_CUSTOMER_FILTER = re.compile(
+    r"\s+AND\s+\w+\.CustomerID\s+IN\s*\(SELECT\s+CustomerID\s+FROM\s+Customers\s+WHERE\s+CompanyName\s+LIKE\s+'%[^']*?(Summer|Winter)[^']*?20\d{2}%'\)",
+    re.IGNORECASE
+)
+_RE_CAMPAIGN_CATEGORY_FILTER = re.compile(
+    r"\s+AND\s+\w+\.CategoryName\s*=\s*'[^']*?(Summer|Winter)[^']*?(Beverages|Classics)[^']*?20\d{2}[^']*?'",
+    re.IGNORECASE
+)
+
+# strftime('%Y-%m', col) = '2013-MM' (for full-year rewrites)
+_RE_MONTH_2013 = re.compile(r"strftime\('%Y-%m',([^)]+)\)\s*=\s*'2013-\d{2}'", re.IGNORECASE)
+
+# IFNULL(Discount, -1)
+_RE_IFNULL_DISCOUNT = re.compile(r"IFNULL\s*\(\s*([^,]+\.)?Discount\s*,\s*-1\s*\)", re.IGNORECASE)
+
+# / COUNT(DISTINCT ..OrderID)[, <num>)] AS <alias> (optional ROUND precision)
+_RE_COUNT_DIV = re.compile(
+    r"\s*/\s*COUNT\s*\(\s*DISTINCT\s+\w+\.OrderID\s*\)(?P<precision>\s*,\s*\d+\s*\))?\s+AS\s+(?P<alias>\w+)",
+    re.IGNORECASE
+)
+_PER_ORDER_ALIASES = frozenset(('aov', 'averageordervalue', 'avgordervalue'))
+
+
+def _strip_count_division(match) -> str:
+    """Drop a per-order division unless the alias is an average (AOV)"""
+    alias = match.group("alias")
+    if alias.lower() in _PER_ORDER_ALIASES:
+        return match.group(0)
+    if match.group("precision"):
+        # ROUND case: keep the precision, ", 2) AS alias"
+        text = match.group(0)
+        return text[text.rfind(','):]
+    return f" AS {alias}"
+
+
+# GROUP BY on Categories columns
+_RE_GROUP_BY_CATEGORIES = re.compile(r"\s+GROUP\s+BY\s+Categories\.\w+", re.IGNORECASE)
+
+
+class SQLCleaner:
+    """
+    Ordered rewrite passes over generated SQL
+
+    Each pass is (name, rewrite, applies): `rewrite(sql)` returns the new SQL
+    and `applies(sql, context)`, if not None, gates it on the SQL so far and
+    a caller-supplied context string.
+    """
+
+    def __init__(self, passes):
+        self.passes = tuple(passes)
+        names = [name for name, _, _ in self.passes]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate SQL cleaner pass names: {names}")
+
+    def __call__(self, sql: str, context: str = "") -> str:
+        for _, rewrite, applies in self.passes:
+            if applies is None or applies(sql, context):
+                sql = rewrite(sql)
+        return sql
+
+
+def _is_full_year_2013(sql: str, constraints_lower: str) -> bool:
+    """Constraints ask for all of 2013 (so a single-month filter is wrong)"""
+    return "2013" in sql and "entire" in constraints_lower or "all of 2013" in constraints_lower
+
+
+# Post-processing for NLToSQLModule output, in dependency order
+# (context is the lowercased constraints string)
+_clean_generated_sql = SQLCleaner((
+    # strftime / BETWEEN / quoting typos
+    ("typos", _fix_sql_typos, None),
+    ("order_details", partial(_RE_ORDERDETAILS.sub, '"Order Details"'), None),
+    # Gibberish like "o- 'Instance'" or "o-'0'" must go before bare Instance
+    ("gibberish_date", partial(_RE_GIBBERISH_DATE.sub, "o.OrderDate"), None),
+    ("instance", partial(_RE_INSTANCE.sub, "0"), None),
+    # strftime('%Y-%m', d) BETWEEN '2013-12-01' AND ... → strftime('%Y-%m', d) = '2013-12'
+    ("month_between", partial(_RE_MONTH_BETWEEN.sub, r"strftime('%Y-%m', \1) = '\2-\3'"), None),
+    # Marketing campaigns are neither customers nor categories
+    ("campaign_customer", partial(_RE_CAMPAIGN_CUSTOMER_FILTER.sub, ""), None),
+    ("campaign_category", partial(_RE_CAMPAIGN_CATEGORY_FILTER.sub, ""), None),
+    # '2013-06' month filter → whole year when the constraints ask for it
+    ("full_year_2013", partial(_RE_MONTH_2013.sub, r"strftime('%Y', \1) = '2013'"), _is_full_year_2013),
+    ("ifnull_discount", partial(_RE_IFNULL_DISCOUNT.sub, r"IFNULL(\1Discount, 0)"), None),
+    # TOTAL revenue/margin must not be divided by the order count (AOV keeps it)
+    ("count_division", partial(_RE_COUNT_DIV.sub, _strip_count_division), None),
+    # GROUP BY Categories.* when Categories isn't joined
+    ("group_by_categories", partial(_RE_GROUP_BY_CATEGORIES.sub, ""), None),
+))
+
+# Output of NLToSQLModule; `cleaned` marks SQL already stripped of code fences
+SQLPrediction = namedtuple("SQLPrediction", ["sql_query", "cleaned"])
+
+
+@lru_cache(maxsize=32)
+def _format_documents(docs: Tuple[Tuple[str, str], ...]) -> str:
+    """Join (chunk_id, content) pairs into the planner's document text"""
+    return "\n\n".join(f"[{chunk_id}] {content}" for chunk_id, content in docs)
+
+
+def _serialize_constraints(constraints) -> str:
+    """Render constraints as canonical compact JSON (strings pass through)"""
+    if isinstance(constraints, str):
+        return constraints
+    return json.dumps(constraints, sort_keys=True, separators=(",", ":"), default=str)
 
 
 # ==================== Signatures ====================
+# Fields render in declaration order, so the (constant) schema goes first to
+# keep a stable prompt prefix that provider-side prompt caching can reuse.
 
 class RouteQuery(dspy.Signature):
     """Route questions to correct handler.
@@ -22,16 +219,16 @@ class RouteQuery(dspy.Signature):
 
 class ExtractConstraints(dspy.Signature):
     """Extract constraints from docs. Know available tables to guide extraction."""
+    schema = dspy.InputField(desc="Available database tables and columns")
     question = dspy.InputField(desc="Question")
     documents = dspy.InputField(desc="Docs")
-    schema = dspy.InputField(desc="Available database tables and columns")
     constraints = dspy.OutputField(desc="JSON constraints")
 
 
 class GenerateSQL(dspy.Signature):
     """CRITICAL: Use strftime (NOT strftForms!). Quote \"Order Details\". Winter=12, Summer=06."""
-    question = dspy.InputField(desc="Question")
     schema = dspy.InputField(desc="Schema")
+    question = dspy.InputField(desc="Question")
     constraints = dspy.InputField(desc="Constraints")
     format_hint = dspy.InputField(desc="Format")
     sql_query = dspy.OutputField(desc="Valid SQL query")
@@ -39,9 +236,9 @@ class GenerateSQL(dspy.Signature):
 
 class RepairSQL(dspy.Signature):
     """Fix typos: strftForms→strftime. Quote \"Order Details\". Tables: Orders, Products, Categories."""
+    schema = dspy.InputField(desc="Schema")
     original_query = dspy.InputField(desc="Failed query")
     error_message = dspy.InputField(desc="Error")
-    schema = dspy.InputField(desc="Schema")
     repaired_query = dspy.OutputField(desc="Corrected SQL")
 
 
@@ -55,6 +252,98 @@ class SynthesizeAnswer(dspy.Signature):
     reason = dspy.OutputField(desc="Short reason <100 chars")
 
 
+# Specialize the SQL signatures' instructions for a concrete database, so the
+# hints sent with every call match the tables/calendar actually in use
+
+_SEASON_MONTHS = {"Winter": "12", "Summer": "06"}
+
+
+def make_generate_sql(season_map: Optional[Dict[str, str]] = None) -> Type[dspy.Signature]:
+    """GenerateSQL with the season→month mapping baked into its instructions"""
+    seasons = ", ".join(f"{season}={month}" for season, month in (season_map or _SEASON_MONTHS).items())
+    return GenerateSQL.with_instructions(
+        f'CRITICAL: Use strftime (NOT strftForms!). Quote "Order Details". {seasons}.'
+    )
+
+
+def make_repair_sql(table_summary: str) -> Type[dspy.Signature]:
+    """RepairSQL with the database's table list baked into its instructions"""
+    return RepairSQL.with_instructions(
+        f'Fix typos: strftForms→strftime. Quote "Order Details". Tables: {table_summary}.'
+    )
+
+
+# ==================== Prediction Cache ====================
+
+class CachedPredict(dspy.Module):
+    """
+    Memoize a dspy.Predict by its exact (whitespace-normalized) inputs
+
+    The key also covers the signature, the active LM settings and the
+    predictor's current demos, so LM changes and optimized copies never share
+    entries. Cache hits are still recorded in the DSPy trace, as Predict does,
+    so optimizers like BootstrapFewShot see every call.
+    """
+
+    def __init__(self, predict: dspy.Predict, maxsize: int = 256):
+        super().__init__()
+        self.predict = predict
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # Copies (e.g. optimizer students) start with an empty cache
+        return CachedPredict(copy.deepcopy(self.predict, memo), self.maxsize)
+
+    def forward(self, **kwargs):
+        key = self._key(kwargs)
+        with self._lock:
+            prediction = self._cache.get(key)
+            if prediction is not None:
+                self._cache.move_to_end(key)
+
+        if prediction is not None:
+            trace = dspy.settings.trace
+            if trace is not None:
+                trace.append((self.predict, {**kwargs}, prediction))
+            return prediction
+
+        prediction = self.predict(**kwargs)
+
+        with self._lock:
+            self._cache[key] = prediction
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return prediction
+
+    def _key(self, inputs: dict) -> str:
+        """sha256 over length-prefixed key parts"""
+        lm = getattr(self.predict, "lm", None) or dspy.settings.lm
+        signature = self.predict.signature
+        parts = [
+            signature.__name__,
+            signature.instructions,
+            json.dumps(list(signature.fields)),
+            getattr(lm, "model", ""),
+            json.dumps({**getattr(lm, "kwargs", {}), **self.predict.config}, sort_keys=True, default=str),
+            json.dumps([dict(demo) for demo in self.predict.demos], sort_keys=True, default=str),
+        ]
+        for name in sorted(inputs):
+            value = inputs[name]
+            if not isinstance(value, str):
+                value = json.dumps(value, sort_keys=True, default=str)
+            parts.append(name)
+            parts.append(" ".join(value.split()))
+
+        h = hashlib.sha256()
+        for part in parts:
+            data = part.encode("utf-8")
+            h.update(len(data).to_bytes(8, "big"))
+            h.update(data)
+        return h.hexdigest()
+
+
 # ==================== Modules ====================
 
 class RouterModule(dspy.Module):
@@ -62,23 +351,18 @@ class RouterModule(dspy.Module):
 
     def __init__(self):
         super().__init__()
-        self.classify = dspy.Predict(RouteQuery)  # Changed from ChainOfThought
+        # Output is a single label: decode deterministically with a short cap
+        # (room left for the adapter's field markers around the label)
+        # Repeat questions hit CachedPredict, whose key includes the active LM
+        self.classify = CachedPredict(dspy.Predict(RouteQuery, temperature=0.0, max_tokens=32))  # Changed from ChainOfThought
 
     def forward(self, question: str) -> str:
         """Route the question to rag, sql, or hybrid"""
         result = self.classify(question=question)
         route = result.route.lower().strip()
 
-        # Normalize output
-        if "hybrid" in route or "both" in route:
-            return "hybrid"
-        elif "sql" in route:
-            return "sql"
-        elif "rag" in route:
-            return "rag"
-        else:
-            # Default to hybrid for complex questions
-            return "hybrid"
+        # Normalize output (default to hybrid for complex questions)
+        return next((canonical for keyword, canonical in _ROUTE_KEYWORDS if keyword in route), "hybrid")
 
 
 class PlannerModule(dspy.Module):
@@ -86,23 +370,19 @@ class PlannerModule(dspy.Module):
 
     def __init__(self):
         super().__init__()
-        self.extract = dspy.Predict(ExtractConstraints)  # Changed from ChainOfThought
+        self.extract = CachedPredict(dspy.Predict(ExtractConstraints))  # Changed from ChainOfThought
 
-    def forward(self, question: str, documents: List[dict], schema: str = "") -> dict:
-        """Extract constraints from question and documents"""
-        # Format documents for LLM
-        doc_text = "\n\n".join([
-            f"[{doc['chunk_id']}] {doc['content']}"
-            for doc in documents
-        ])
+    def forward(self, question: str, documents: Dict[str, list], schema: str = "") -> dict:
+        """Extract constraints from question and documents (chunk_ids/contents columns)"""
+        # Format documents for LLM (memoized for repeated doc sets)
+        doc_text = _format_documents(tuple(zip(documents["chunk_ids"], documents["contents"])))
 
         result = self.extract(question=question, documents=doc_text, schema=schema)
 
         # Parse constraints (try to extract JSON-like structure)
-        import json
         try:
-            constraints = json.loads(result.constraints)
-        except:
+            constraints = _json_loads(result.constraints)
+        except (ValueError, TypeError):
             # If not valid JSON, create structured output
             constraints = {
                 "date_range": None,
@@ -111,17 +391,17 @@ class PlannerModule(dspy.Module):
                 "entities": []
             }
 
-            # Try to extract information from text
-            constraints_text = result.constraints.lower()
+            # Try to extract information from text (single scan)
+            found = {m.lastgroup for m in _CONSTRAINT_HINTS_RE.finditer(result.constraints)}
 
-            if "1997-06" in result.constraints or "june 1997" in constraints_text:
+            if "jun97" in found:
                 constraints["date_range"] = {"start": "1997-06-01", "end": "1997-06-30"}
-            elif "1997-12" in result.constraints or "december 1997" in constraints_text:
+            elif "dec97" in found:
                 constraints["date_range"] = {"start": "1997-12-01", "end": "1997-12-31"}
 
-            if "aov" in constraints_text or "average order value" in constraints_text:
+            if "aov" in found:
                 constraints["kpi_formula"] = "AOV"
-            elif "gross margin" in constraints_text or "margin" in constraints_text:
+            elif "margin" in found:
                 constraints["kpi_formula"] = "GrossMargin"
 
         return constraints
@@ -130,13 +410,14 @@ class PlannerModule(dspy.Module):
 class NLToSQLModule(dspy.Module):
     """Convert natural language to SQL"""
 
-    def __init__(self):
+    def __init__(self, signature: Type[dspy.Signature] = GenerateSQL):
         super().__init__()
-        self.generate = dspy.Predict(GenerateSQL)  # Changed from ChainOfThought
+        self.generate = CachedPredict(dspy.Predict(signature))  # Changed from ChainOfThought
 
-    def forward(self, question: str, schema: str, constraints: dict, format_hint: str = "") -> str:
+    def forward(self, question: str, schema: str, constraints: dict, format_hint: str = "") -> SQLPrediction:
         """Generate SQL query from question"""
-        constraints_str = str(constraints)
+        constraints_str = _serialize_constraints(constraints)
+        constraints_lower = constraints_str.lower()
         result = self.generate(
             question=question,
             schema=schema,
@@ -145,147 +426,49 @@ class NLToSQLModule(dspy.Module):
         )
 
         # Extract SQL from response (remove markdown code blocks if present)
-        sql = result.sql_query.strip()
-        if "```sql" in sql:
-            sql = sql.split("```sql")[1].split("```")[0].strip()
-        elif "```" in sql:
-            sql = sql.split("```")[1].split("```")[0].strip()
-
-        # Auto-fix common typos
-        import re
-        sql = sql.replace("strftForms", "strftime")
-        sql = sql.replace("strftTime", "strftime")
-        sql = sql.replace("BETWEWEN", "BETWEEN")
-        sql = sql.replace("BETWEInstance", "BETWEEN")
-        sql = sql.replace("`Order Details`", '"Order Details"')
-        # Fix OrderDetails (no space) → "Order Details" (with space and quotes)
-        sql = re.sub(r'\bOrderDetails\b', '"Order Details"', sql)
-        sql = re.sub(r'\border_details\b', '"Order Details"', sql, flags=re.IGNORECASE)
-
-        # Fix gibberish patterns like "o- 'Instance'" or "o-'0'"
-        sql = re.sub(r"[a-z]-\s*'(?:Instance|0)'", "o.OrderDate", sql)
-
-        # Fix standalone Instance
-        sql = re.sub(r'\bInstance\b', '0', sql)
-
-        # Fix BETWEEN with strftime('%Y-%m') - should use = instead
-        # Pattern: strftime('%Y-%m', o.OrderDate) BETWEEN '2013-12-01' AND '2013-12-31'
-        # Should be: strftime('%Y-%m', o.OrderDate) = '2013-12'
-        sql = re.sub(
-            r"strftime\('%Y-%m',\s*([^)]+)\)\s+BETWEEN\s+'(\d{4})-(\d{2})-\d{2}'\s+AND\s+'[^']+?'",
-            r"strftime('%Y-%m', \1) = '\2-\3'",
-            sql,
-            flags=re.IGNORECASE
-        )
+        sql = _strip_fence(result.sql_query)
 
-        # DISABLED: Fix ROUND() - this was adding duplicate , 2) parameters
-        # The model now generates correct ROUND syntax, so this fix is no longer needed
-        # def fix_round(match):
-        #     content = match.group(1)
-        #     alias = match.group(2)
-        #     return f"ROUND({content}, 2) AS {alias}"
-        # sql = re.sub(r"ROUND\s*\(\s*(.*?)\s+AS\s+(\w+)", fix_round, sql, flags=re.IGNORECASE | re.DOTALL)
-
-        # Remove incorrect customer name filters for marketing campaigns
-        # Pattern: AND o.CustomerID IN (SELECT CustomerID FROM Customers WHERE CompanyName LIKE '%Summer Beverages 2013%')
-        sql = re.sub(
-            r"\s+AND\s+\w+\.CustomerID\s+IN\s*\(SELECT\s+CustomerID\s+FROM\s+Customers\s+WHERE\s+CompanyName\s+LIKE\s+'%[^']*?(Summer|Winter)[^']*?20\d{2}%'\)",
-            "",
-            sql,
-            flags=re.IGNORECASE
-        )
+        # Auto-fix typos and known model mistakes (see _clean_generated_sql)
+        sql = _clean_generated_sql(sql, constraints_lower)
 
-        # Remove incorrect CategoryName filters for marketing campaigns
-        # Pattern: AND Categories.CategoryName='Summer Beverages' (marketing campaigns are NOT categories)
-        sql = re.sub(
-            r"\s+AND\s+\w+\.CategoryName\s*=\s*'[^']*?(Summer|Winter)[^']*?(Beverages|Classics)[^']*?20\d{2}[^']*?'",
-            "",
-            sql,
-            flags=re.IGNORECASE
-        )
-
-        # Fix wrong date range for yearly queries: '2013-06' -> '2013%' when asking about full year
-        # Only fix if the query doesn't mention a specific month/season in constraints
-        if "2013" in sql and "entire" in str(constraints).lower() or "all of 2013" in str(constraints).lower():
-            sql = re.sub(
-                r"strftime\('%Y-%m',([^)]+)\)\s*=\s*'2013-\d{2}'",
-                r"strftime('%Y', \1) = '2013'",
-                sql,
-                flags=re.IGNORECASE
-            )
-
-        # Fix IFNULL with wrong default for Discount: IFNULL(Discount, -1) -> IFNULL(Discount, 0)
-        sql = re.sub(
-            r"IFNULL\s*\(\s*([^,]+\.)?Discount\s*,\s*-1\s*\)",
-            r"IFNULL(\1Discount, 0)",
-            sql,
-            flags=re.IGNORECASE
-        )
-
-        # CRITICAL FIX: Remove division by order count when calculating TOTAL revenue or margin
-        # Use string manipulation to handle deeply nested parentheses
-        # Pattern 1: / COUNT(DISTINCT ..OrderID) AS <alias> (simple case)
-        # Pattern 2: / COUNT(DISTINCT ..OrderID), <num>) AS <alias> (ROUND case)
-        import re
-
-        # Handle ROUND case first: / COUNT(DISTINCT ..OrderID), 2) AS <alias>
-        pattern_round = r"\s*/\s*COUNT\s*\(\s*DISTINCT\s+\w+\.OrderID\s*\)\s*,\s*\d+\s*\)\s+AS\s+(\w+)"
-        matches_round = list(re.finditer(pattern_round, sql, re.IGNORECASE))
-        for match in reversed(matches_round):
-            alias = match.group(1)
-            if alias.lower() not in ['aov', 'averageordervalue', 'avgordervalue']:
-                # Remove / COUNT(DISTINCT ..OrderID), keep the precision: , 2) AS alias
-                comma_pos = match.group(0).rfind(',')
-                remainder = match.group(0)[comma_pos:]  # ", 2) AS alias"
-                sql = sql[:match.start()] + remainder + sql[match.end():]
-
-        # Handle simple case: / COUNT(DISTINCT ..OrderID) AS <alias>
-        pattern_simple = r"\s*/\s*COUNT\s*\(\s*DISTINCT\s+\w+\.OrderID\s*\)\s+AS\s+(\w+)"
-        matches_simple = list(re.finditer(pattern_simple, sql, re.IGNORECASE))
-        for match in reversed(matches_simple):
-            alias = match.group(1)
-            if alias.lower() not in ['aov', 'averageordervalue', 'avgordervalue']:
-                sql = sql[:match.start()] + f" AS {alias}" + sql[match.end():]
-
-        # Remove GROUP BY clauses that reference tables not in the query
-        # Pattern: GROUP BY Categories.CategoryName when Categories not joined
-        sql = re.sub(
-            r"\s+GROUP\s+BY\s+Categories\.\w+",
-            "",
-            sql,
-            flags=re.IGNORECASE
-        )
-
-        return sql
+        return SQLPrediction(sql, True)
 
 
 class SQLRepairModule(dspy.Module):
-    """Repair failed SQL queries"""
+    """
+    Repair failed SQL queries
 
-    def __init__(self):
+    `validate_sql`, if given, checks a candidate query locally (e.g. EXPLAIN
+    against a schema-only database); typo-fixed queries that pass it are
+    returned without an LLM call.
+    """
+
+    def __init__(
+        self,
+        validate_sql: Optional[Callable[[str], bool]] = None,
+        signature: Type[dspy.Signature] = RepairSQL
+    ):
         super().__init__()
-        self.repair = dspy.Predict(RepairSQL)  # Changed from ChainOfThought
+        self.repair = CachedPredict(dspy.Predict(signature))  # Changed from ChainOfThought
+        self.validate_sql = validate_sql
 
     def forward(self, original_query: str, error_message: str, schema: str) -> str:
         """Repair a failed SQL query"""
-        # Auto-fix common typos first
-        fixed_query = original_query
-        # strftime typos
-        fixed_query = fixed_query.replace("strftForms", "strftime")
-        fixed_query = fixed_query.replace("strftTime", "strftime")
-        # BETWEEN typos
-        fixed_query = fixed_query.replace("BETWEWEN", "BETWEEN")
-        fixed_query = fixed_query.replace("BETWEInstance", "BETWEEN")
-        # Table name issues
-        fixed_query = fixed_query.replace("`Order Details`", '"Order Details"')
-        fixed_query = fixed_query.replace("OrderDetails", '"Order Details"')
+        # Auto-fix common typos first (strftime, BETWEEN, table names)
+        fixed_query = _fix_repair_typos(original_query)
         # Instance typo (when model types Instance instead of 0)
-        import re
-        fixed_query = re.sub(r'\bInstance\b', '0', fixed_query)
-
-        # If we fixed typos and error is about syntax, return fixed version
-        if fixed_query != original_query and ("syntax" in error_message.lower() or "no such" in error_message.lower()):
-            return fixed_query
+        fixed_query = _RE_INSTANCE.sub('0', fixed_query)
+
+        if fixed_query != original_query:
+            if self.validate_sql is not None:
+                # Deterministic fix compiles against the schema; no LLM needed
+                if self.validate_sql(fixed_query):
+                    return fixed_query
+            else:
+                # Without a validator, trust the fix for syntax/name errors
+                error_lower = error_message.lower()
+                if "syntax" in error_lower or "no such" in error_lower:
+                    return fixed_query
 
         result = self.repair(
             original_query=original_query,
@@ -294,16 +477,10 @@ class SQLRepairModule(dspy.Module):
         )
 
         # Extract SQL
-        sql = result.repaired_query.strip()
-        if "```sql" in sql:
-            sql = sql.split("```sql")[1].split("```")[0].strip()
-        elif "```" in sql:
-            sql = sql.split("```")[1].split("```")[0].strip()
+        sql = _strip_fence(result.repaired_query)
 
         # Apply typo fixes to repaired query too
-        sql = sql.replace("strftForms", "strftime")
-        sql = sql.replace("strftTime", "strftime")
-        sql = sql.replace("`Order Details`", '"Order Details"')
+        sql = _fix_sql_typos(sql)
 
         return sql
 
@@ -313,20 +490,20 @@ class SynthesizerModule(dspy.Module):
 
     def __init__(self):
         super().__init__()
-        self.synthesize = dspy.Predict(SynthesizeAnswer)  # Changed from ChainOfThought
+        self.synthesize = CachedPredict(dspy.Predict(SynthesizeAnswer))  # Changed from ChainOfThought
 
     def forward(
         self,
         question: str,
         format_hint: str,
         sql_results: Optional[dict] = None,
-        documents: Optional[List[dict]] = None
+        documents: Optional[Dict[str, list]] = None
     ) -> dict:
         """Generate final answer matching format_hint"""
 
         # Format SQL results - extract just the data
         if sql_results and isinstance(sql_results, dict) and sql_results.get("success"):
-            data = sql_results.get("data", [])[:5]  # Max 5 rows
+            data = list(islice(sql_results.get("data", []), 5))  # Max 5 rows
             cols = sql_results.get("columns", [])
             sql_str = f"Cols: {cols} Rows: {data}"
         else:
@@ -334,8 +511,11 @@ class SynthesizerModule(dspy.Module):
             sql_str = f"No data (error: {error})"
 
         # Format documents - extract just content
-        if documents:
-            doc_str = "\n".join([f"{d.get('chunk_id', 'doc')}: {d.get('content', '')[:200]}" for d in documents[:3]])
+        if documents and documents["chunk_ids"]:
+            doc_str = "\n".join(
+                f"{chunk_id}: {content[:200]}"
+                for chunk_id, content in islice(zip(documents["chunk_ids"], documents["contents"]), 3)
+            )
         else:
             doc_str = "No docs"
 
@@ -348,9 +528,9 @@ class SynthesizerModule(dspy.Module):
 
         # Truncate explanation: max 2 sentences OR 150 chars
         explanation = result.reason.strip()
-        sentences = explanation.split('. ')
-        if len(sentences) > 2:
-            explanation = '. '.join(sentences[:2])
+        m = _TWO_SENTENCES_RE.match(explanation)
+        if m:
+            explanation = m.group(1)
             if not explanation.endswith('.'):
                 explanation += '.'
 
@@ -3,8 +3,19 @@ LangGraph hybrid agent with ≥6 nodes and repair loop
 """
 from typing import TypedDict, List, Optional, Dict, Any, Annotated
 from langgraph.graph import StateGraph, END
+import asyncio
+import contextvars
+import copy
+import functools
 import json
 import re
+import sqlite3
+import threading
+import numpy as np
+import dspy
+from dspy.dsp.utils.settings import thread_local_overrides
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from agent.rag import TFIDFRetriever
 from agent.tools import SQLiteTool
 from agent.dspy_signatures import (
@@ -12,12 +23,113 @@ from agent.dspy_signatures import (
     PlannerModule,
     NLToSQLModule,
     SQLRepairModule,
-    SynthesizerModule
+    SynthesizerModule,
+    make_generate_sql,
+    make_repair_sql
 )
 
+try:
+    import orjson  # optional: C-backed JSON parsing
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+
+# Lexical signals that a SQL question depends on doc-derived constraints
+# (policy wording, KPI definitions, named date ranges)
+_TRIGGER_RE = re.compile(
+    r'\b(according to|per the|policy|AOV|gross margin|summer|winter|Q[1-4])\b',
+    re.IGNORECASE
+)
+
+# Appended to the error for the second, speculative repair draft
+_REPAIR_RETRY_HINT = " (check table/column names and quoting against the schema)"
+
+_INT_RE = re.compile(r'\d+')
+_NUMBER_RE = re.compile(r'\d+\.?\d*')
+
+# Returned by a format parser when SQL results can't satisfy the hint
+_NO_PARSE = object()
+
+
+def _row_to_dict(row, columns: List[str]) -> Dict[str, Any]:
+    """First two columns of a result row as {label: rounded value}"""
+    return {columns[0]: row[0], columns[1]: round(float(row[1]), 2) if row[1] is not None else 0.0}
+
+
+# The caller's dspy.context overrides for the current run. dspy keeps them per
+# thread, so arun() captures them and LM calls on worker threads re-enter them
+# (as dspy.Parallel does)
+_DSPY_OVERRIDES: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar(
+    "dspy_overrides", default={}
+)
+
+
+def _current_dspy_overrides() -> Dict[str, Any]:
+    """This thread's dspy.context overrides (thread- or context-local by dspy version)"""
+    if isinstance(thread_local_overrides, contextvars.ContextVar):
+        return dict(thread_local_overrides.get())
+    return dict(thread_local_overrides.overrides)
+
+
+def _in_dspy_context(func, *args, **kwargs):
+    """Call func under the current run's dspy.context overrides"""
+    with dspy.context(**_DSPY_OVERRIDES.get()):
+        return func(*args, **kwargs)
+
+
+def _to_thread(func, *args, **kwargs):
+    """asyncio.to_thread for LM calls: keeps the run's dspy.context overrides"""
+    return asyncio.to_thread(_in_dspy_context, func, *args, **kwargs)
+
+
+def _with_dspy_context(node):
+    """Wrap a sync node (run on LangGraph's executor) in the run's dspy.context"""
+    @functools.wraps(node)
+    def wrapper(state):
+        return _in_dspy_context(node, state)
+    return wrapper
+
+
+def _run_sync(coro):
+    """Run a coroutine to completion from sync code, even inside a running loop"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Already in an event loop (Jupyter, async hosts): asyncio.run would raise,
+    # so drive the coroutine on its own loop in a worker thread, carrying over
+    # the caller's dspy.context
+    overrides = _current_dspy_overrides()
+
+    def drive():
+        with dspy.context(**overrides):
+            return asyncio.run(coro)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(drive).result()
+
 
 # ==================== State Definition ====================
 
+class RetrievedDocs(TypedDict):
+    """Retrieved chunks as parallel columns (index i is one chunk)"""
+    chunk_ids: List[str]
+    contents: List[str]
+    sources: List[str]
+    scores: np.ndarray  # float32
+
+
+def _empty_docs() -> RetrievedDocs:
+    """Column set with no chunks"""
+    return {
+        "chunk_ids": [],
+        "contents": [],
+        "sources": [],
+        "scores": np.zeros(0, dtype=np.float32)
+    }
+
+
 class AgentState(TypedDict):
     """State for the hybrid agent"""
     # Input
@@ -28,7 +140,7 @@ class AgentState(TypedDict):
     route: Optional[str]
 
     # RAG
-    retrieved_docs: List[Dict]
+    retrieved_docs: RetrievedDocs
     doc_chunk_ids: List[str]
 
     # Planning
@@ -62,21 +174,45 @@ class HybridAgent:
         self,
         retriever: TFIDFRetriever,
         db_tool: SQLiteTool,
-        router: RouterModule,
-        planner: PlannerModule,
-        nl_to_sql: NLToSQLModule,
-        sql_repair: SQLRepairModule,
-        synthesizer: SynthesizerModule
+        router: Optional[RouterModule] = None,
+        planner: Optional[PlannerModule] = None,
+        nl_to_sql: Optional[NLToSQLModule] = None,
+        sql_repair: Optional[SQLRepairModule] = None,
+        synthesizer: Optional[SynthesizerModule] = None
     ):
+        """
+        Modules left as None are built here; the SQL ones get signatures
+        specialized to this database (calendar mapping, actual table list).
+        Pass prebuilt modules (e.g. an optimized NL→SQL) to use them as-is.
+        """
         self.retriever = retriever
         self.db_tool = db_tool
-        self.router = router
-        self.planner = planner
-        self.nl_to_sql = nl_to_sql
-        self.sql_repair = sql_repair
-        self.synthesizer = synthesizer
         self.schema = db_tool.get_schema()
 
+        # Schema-only copy of the DB so repairs can be EXPLAIN-checked locally
+        self._schema_db = db_tool.clone_schema()
+        self._schema_db_lock = threading.Lock()
+
+        if sql_repair is None:
+            sql_repair = SQLRepairModule(self._validate_on_schema, make_repair_sql(db_tool.table_summary()))
+        elif sql_repair.validate_sql is None:
+            # Shallow copy (same predictor) so a module shared between agents
+            # isn't rebound to this agent's schema database
+            sql_repair = copy.copy(sql_repair)
+            sql_repair.validate_sql = self._validate_on_schema
+
+        self.router = router or RouterModule()
+        self.planner = planner or PlannerModule()
+        self.nl_to_sql = nl_to_sql or NLToSQLModule(make_generate_sql())
+        self.sql_repair = sql_repair
+        self.synthesizer = synthesizer or SynthesizerModule()
+
+        # Format-hint parsers with exact-match hints; prefix hints are resolved in _resolve_parser
+        self._parsers = {
+            "int": self._parse_int_rows,
+            "float": self._parse_float_rows
+        }
+
         # Build graph
         self.graph = self._build_graph()
 
@@ -84,14 +220,15 @@ class HybridAgent:
         """Build the LangGraph workflow"""
         workflow = StateGraph(AgentState)
 
-        # Add nodes
+        # Add nodes (sync LM nodes run on executor threads, so they re-enter
+        # the caller's dspy.context there)
         workflow.add_node("router", self._route_node)
         workflow.add_node("retriever", self._retriever_node)
-        workflow.add_node("planner", self._planner_node)
-        workflow.add_node("nl_to_sql", self._nl_to_sql_node)
+        workflow.add_node("planner", _with_dspy_context(self._planner_node))
+        workflow.add_node("nl_to_sql", _with_dspy_context(self._nl_to_sql_node))
         workflow.add_node("executor", self._executor_node)
         workflow.add_node("repair", self._repair_node)
-        workflow.add_node("synthesizer", self._synthesizer_node)
+        workflow.add_node("synthesizer", _with_dspy_context(self._synthesizer_node))
 
         # Define edges
         workflow.set_entry_point("router")
@@ -102,7 +239,8 @@ class HybridAgent:
             self._route_decision,
             {
                 "rag": "retriever",
-                "sql": "planner",  # Still need planning for SQL
+                "sql": "planner",  # SQL that may need doc-derived constraints
+                "sql_direct": "nl_to_sql",  # Plain SQL; constraints stay empty
                 "hybrid": "retriever"
             }
         )
@@ -134,8 +272,17 @@ class HybridAgent:
             }
         )
 
-        # After repair, try executing again
-        workflow.add_edge("repair", "executor")
+        # Repair executes its own candidates; a failed round retries (up to 2x)
+        # from the winning candidate's error
+        workflow.add_conditional_edges(
+            "repair",
+            self._after_executor_decision,
+            {
+                "success": "synthesizer",
+                "repair": "repair",
+                "fail": "synthesizer"
+            }
+        )
 
         # Synthesizer is the end
         workflow.add_edge("synthesizer", END)
@@ -144,36 +291,40 @@ class HybridAgent:
 
     # ==================== Node Implementations ====================
 
-    def _route_node(self, state: AgentState) -> AgentState:
-        """Node 1: Route the query"""
+    async def _route_node(self, state: AgentState) -> AgentState:
+        """Node 1: Route the query (retrieval runs speculatively alongside)"""
         state["trace"].append("ROUTER: Classifying query type")
 
-        route = self.router(question=state["question"])
+        # Retrieval doesn't depend on the route, so hide it under the router LLM call
+        route, docs = await asyncio.gather(
+            _to_thread(self.router, question=state["question"]),
+            asyncio.to_thread(self.retriever.retrieve, state["question"], 3)
+        )
         state["route"] = route
 
         state["trace"].append(f"ROUTER: Route = {route}")
+
+        # SQL route doesn't use docs; discard the speculative retrieval
+        if route != "sql":
+            self._set_retrieved_docs(state, docs)
+        elif not self._needs_planner(state):
+            state["trace"].append("ROUTER: Plain SQL question, skipping planner")
+
         return state
 
-    def _retriever_node(self, state: AgentState) -> AgentState:
+    async def _retriever_node(self, state: AgentState) -> AgentState:
         """Node 2: Retrieve relevant documents"""
         state["trace"].append("RETRIEVER: Fetching relevant documents")
 
-        docs = self.retriever.retrieve(state["question"], top_k=3)
-
-        state["retrieved_docs"] = [
-            {
-                "chunk_id": doc.chunk_id,
-                "content": doc.content,
-                "source": doc.source,
-                "score": doc.score
-            }
-            for doc in docs
-        ]
-
-        state["doc_chunk_ids"] = [doc.chunk_id for doc in docs]
+        if state["retrieved_docs"]["chunk_ids"]:
+            state["trace"].append("RETRIEVER: Using chunks prefetched during routing")
+        else:
+            # TF-IDF scoring is CPU work; keep it off the event loop
+            docs = await asyncio.to_thread(self.retriever.retrieve, state["question"], 3)
+            self._set_retrieved_docs(state, docs)
 
         state["trace"].append(
-            f"RETRIEVER: Retrieved {len(docs)} chunks: {state['doc_chunk_ids']}"
+            f"RETRIEVER: Retrieved {len(state['doc_chunk_ids'])} chunks: {state['doc_chunk_ids']}"
         )
 
         return state
@@ -183,12 +334,10 @@ class HybridAgent:
         state["trace"].append("PLANNER: Extracting constraints")
 
         # Use retrieved docs if available
-        docs = state.get("retrieved_docs", [])
-
-        # Get schema for context-aware constraint extraction
-        schema = self.db_tool.get_schema()
+        docs = state.get("retrieved_docs") or _empty_docs()
 
-        constraints = self.planner(question=state["question"], documents=docs, schema=schema)
+        # Schema (fetched once in __init__) for context-aware constraint extraction
+        constraints = self.planner(question=state["question"], documents=docs, schema=self.schema)
         state["constraints"] = constraints
 
         state["trace"].append(f"PLANNER: Constraints = {constraints}")
@@ -204,7 +353,7 @@ class HybridAgent:
             schema=self.schema,
             constraints=state["constraints"],
             format_hint=state.get("format_hint", "")
-        )
+        ).sql_query
 
         state["sql_query"] = sql
         state["trace"].append(f"NL→SQL: Generated query: {sql[:100]}...")
@@ -216,36 +365,40 @@ class HybridAgent:
         state["trace"].append("EXECUTOR: Running SQL query")
 
         result = self.db_tool.execute_query(state["sql_query"])
-
-        if result["success"]:
-            state["sql_results"] = result
-            state["tables_used"] = result["tables_used"]
-            state["sql_error"] = None
-            state["trace"].append(
-                f"EXECUTOR: Success! Got {len(result['data'])} rows"
-            )
-        else:
-            # Still set sql_results with error info for synthesizer
-            state["sql_results"] = result
-            state["sql_error"] = result["error"]
-            state["trace"].append(f"EXECUTOR: Error - {result['error']}")
+        self._apply_sql_result(state, result, "EXECUTOR")
 
         return state
 
-    def _repair_node(self, state: AgentState) -> AgentState:
-        """Node 6: Repair failed SQL query"""
-        state["trace"].append(f"REPAIR: Attempting repair (attempt {state['repair_count'] + 1})")
+    async def _repair_node(self, state: AgentState) -> AgentState:
+        """Node 6: Repair failed SQL query (two candidates drafted and run in parallel)"""
+        state["trace"].append("REPAIR: Drafting 2 repair candidates")
 
-        repaired_sql = self.sql_repair(
-            original_query=state["sql_query"],
-            error_message=state["sql_error"],
-            schema=self.schema
-        )
+        original_query = state["sql_query"]
+        error_message = state["sql_error"]
 
-        state["sql_query"] = repaired_sql
+        # Second draft gets an extra hint so it isn't a cache hit of the first
+        candidates = await asyncio.gather(*(
+            _to_thread(
+                self.sql_repair,
+                original_query=original_query,
+                error_message=message,
+                schema=self.schema
+            )
+            for message in (error_message, error_message + _REPAIR_RETRY_HINT)
+        ))
+        candidates = list(dict.fromkeys(candidates))
+
+        results = await asyncio.gather(*(
+            asyncio.to_thread(self.db_tool.execute_query, candidate)
+            for candidate in candidates
+        ))
         state["repair_count"] += 1
 
-        state["trace"].append(f"REPAIR: New query: {repaired_sql[:100]}...")
+        # First successful candidate wins; otherwise keep the first one's error
+        index = next((i for i, result in enumerate(results) if result["success"]), 0)
+        state["sql_query"] = candidates[index]
+        state["trace"].append(f"REPAIR: New query: {candidates[index][:100]}...")
+        self._apply_sql_result(state, results[index], "REPAIR")
 
         return state
 
@@ -284,7 +437,14 @@ class HybridAgent:
 
     def _route_decision(self, state: AgentState) -> str:
         """Decide path after routing"""
-        return state["route"]
+        route = state["route"]
+        if route == "sql" and not self._needs_planner(state):
+            return "sql_direct"
+        return route
+
+    def _needs_planner(self, state: AgentState) -> bool:
+        """Whether a SQL question mentions anything the planner could resolve"""
+        return _TRIGGER_RE.search(state["question"]) is not None
 
     def _after_planner_decision(self, state: AgentState) -> str:
         """Decide if SQL is needed after planning"""
@@ -295,7 +455,7 @@ class HybridAgent:
             return "sql"
 
     def _after_executor_decision(self, state: AgentState) -> str:
-        """Decide if repair is needed after execution"""
+        """Decide if (another) repair is needed after execution or a repair round"""
         if state["sql_error"] is None:
             return "success"
         elif state["repair_count"] < 2:
@@ -305,65 +465,109 @@ class HybridAgent:
 
     # ==================== Helper Functions ====================
 
+    def _apply_sql_result(self, state: AgentState, result: Dict, stage: str) -> None:
+        """Record an execute_query result in the state"""
+        if result["success"]:
+            state["sql_results"] = result
+            state["tables_used"] = result["tables_used"]
+            state["sql_error"] = None
+            state["trace"].append(
+                f"{stage}: Success! Got {len(result['data'])} rows"
+            )
+        else:
+            # Still set sql_results with error info for synthesizer
+            state["sql_results"] = result
+            state["sql_error"] = result["error"]
+            state["trace"].append(f"{stage}: Error - {result['error']}")
+
+    def _validate_on_schema(self, sql: str) -> bool:
+        """Check that SQL compiles against the schema-only database"""
+        if not sqlite3.complete_statement(sql + "\n;"):
+            return False
+        try:
+            with self._schema_db_lock:
+                self._schema_db.execute(f"EXPLAIN {sql}")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _set_retrieved_docs(self, state: AgentState, docs: List) -> None:
+        """Store retrieved Document objects in the state as columns"""
+        columns = _empty_docs()
+        scores = []
+        for doc in docs:
+            columns["chunk_ids"].append(doc.chunk_id)
+            columns["contents"].append(doc.content)
+            columns["sources"].append(doc.source)
+            scores.append(doc.score)
+        columns["scores"] = np.asarray(scores, dtype=np.float32)
+
+        state["retrieved_docs"] = columns
+        state["doc_chunk_ids"] = columns["chunk_ids"]
+
     def _parse_answer(self, answer_str: str, format_hint: str, sql_results: Optional[Dict]) -> Any:
         """Parse the answer string to match the format hint"""
 
         # Try to extract from SQL results first for structured data
         if sql_results and sql_results.get("success"):
-            data = sql_results.get("data", [])
-            columns = sql_results.get("columns", [])
-
-            if format_hint == "int":
-                if data and len(data) > 0:
-                    return int(data[0][0]) if data[0][0] is not None else 0
-                # Try parsing from answer string
-                numbers = re.findall(r'\d+', answer_str)
-                return int(numbers[0]) if numbers else 0
-
-            elif format_hint == "float":
-                if data and len(data) > 0:
-                    val = data[0][0]
-                    return round(float(val), 2) if val is not None else 0.0
-                # Try parsing from answer string
-                numbers = re.findall(r'\d+\.?\d*', answer_str)
-                return round(float(numbers[0]), 2) if numbers else 0.0
-
-            elif "list[" in format_hint:
-                # Return list of dictionaries
-                results = []
-                for row in data[:3]:  # Top 3
-                    if len(columns) >= 2:
-                        results.append({
-                            columns[0]: row[0],
-                            columns[1]: round(float(row[1]), 2) if row[1] is not None else 0.0
-                        })
-                return results
-
-            elif format_hint.startswith("{"):
-                # Return single dictionary
-                if data and len(data) > 0:
-                    row = data[0]
-                    if len(columns) >= 2:
-                        return {
-                            columns[0]: row[0],
-                            columns[1]: round(float(row[1]), 2) if row[1] is not None else 0.0
-                        }
+            parser = self._resolve_parser(format_hint)
+            if parser is not None:
+                parsed = parser(sql_results.get("data", []), sql_results.get("columns", []), answer_str)
+                if parsed is not _NO_PARSE:
+                    return parsed
 
         # Fallback: try to parse from answer_str
         try:
             # Try JSON parsing
-            parsed = json.loads(answer_str)
-            return parsed
-        except:
+            return _json_loads(answer_str)
+        except (ValueError, TypeError):
             pass
 
         # Last resort: extract based on format
         if format_hint == "int":
-            numbers = re.findall(r'\d+', answer_str)
+            numbers = _INT_RE.findall(answer_str)
             return int(numbers[0]) if numbers else 14
 
         return answer_str
 
+    def _resolve_parser(self, format_hint: str):
+        """Pick the SQL-result parser for a format hint (None if there isn't one)"""
+        parser = self._parsers.get(format_hint)
+        if parser is not None:
+            return parser
+        if "list[" in format_hint:
+            return self._parse_list_rows
+        if format_hint.startswith("{"):
+            return self._parse_dict_row
+        return None
+
+    def _parse_int_rows(self, data: List, columns: List[str], answer_str: str) -> int:
+        """First cell as int, else first integer in the answer string"""
+        if data:
+            return int(data[0][0]) if data[0][0] is not None else 0
+        numbers = _INT_RE.findall(answer_str)
+        return int(numbers[0]) if numbers else 0
+
+    def _parse_float_rows(self, data: List, columns: List[str], answer_str: str) -> float:
+        """First cell as a 2dp float, else first number in the answer string"""
+        if data:
+            val = data[0][0]
+            return round(float(val), 2) if val is not None else 0.0
+        numbers = _NUMBER_RE.findall(answer_str)
+        return round(float(numbers[0]), 2) if numbers else 0.0
+
+    def _parse_list_rows(self, data: List, columns: List[str], answer_str: str) -> List[Dict]:
+        """Top 3 rows as {label: value} dicts"""
+        if len(columns) < 2:
+            return []
+        return [_row_to_dict(row, columns) for row in data[:3]]
+
+    def _parse_dict_row(self, data: List, columns: List[str], answer_str: str) -> Any:
+        """First row as a {label: value} dict"""
+        if data and len(columns) >= 2:
+            return _row_to_dict(data[0], columns)
+        return _NO_PARSE
+
     def _calculate_confidence(self, state: AgentState) -> float:
         """Calculate confidence score"""
         confidence = 0.5  # Base confidence
@@ -373,9 +577,9 @@ class HybridAgent:
             confidence += 0.3
 
         # Boost for good retrieval scores
-        if state.get("retrieved_docs"):
-            avg_score = sum(d["score"] for d in state["retrieved_docs"]) / len(state["retrieved_docs"])
-            confidence += avg_score * 0.2
+        docs = state.get("retrieved_docs")
+        if docs and len(docs["scores"]):
+            confidence += float(docs["scores"].mean()) * 0.2
 
         # Penalize for repairs
         if state["repair_count"] > 0:
@@ -385,27 +589,67 @@ class HybridAgent:
 
     def _collect_citations(self, state: AgentState) -> List[str]:
         """Collect all citations (tables + doc chunks)"""
-        citations = []
-
-        # Add tables
-        if state.get("tables_used"):
-            citations.extend(state["tables_used"])
-
-        # Add doc chunks
-        if state.get("doc_chunk_ids"):
-            citations.extend(state["doc_chunk_ids"])
-
-        return list(set(citations))
+        # Tables, then doc chunks by rank; dedupe keeping first-seen order
+        return list(dict.fromkeys(chain(
+            state.get("tables_used") or (),
+            state.get("doc_chunk_ids") or ()
+        )))
 
     # ==================== Public Interface ====================
 
+    def close(self):
+        """Release the schema-only database (db_tool stays open; it's the caller's)"""
+        with self._schema_db_lock:
+            self._schema_db.close()
+
     def run(self, question: str, format_hint: str) -> Dict[str, Any]:
         """Run the agent on a question"""
+        return _run_sync(self.arun(question, format_hint))
+
+    def run_batch(
+        self,
+        questions: List[str],
+        format_hints: List[str],
+        max_concurrency: int = 8
+    ) -> List[Dict[str, Any]]:
+        """Run the agent on many questions, overlapping their LLM calls"""
+        return _run_sync(self.arun_batch(questions, format_hints, max_concurrency))
+
+    async def arun_batch(
+        self,
+        questions: List[str],
+        format_hints: List[str],
+        max_concurrency: int = 8
+    ) -> List[Dict[str, Any]]:
+        """
+        Run the agent on many questions concurrently
+
+        Each question still walks the graph on its own, but blocking nodes run
+        on worker threads, so every stage's LM requests from different
+        questions are in flight together (and can be batched server-side).
+        Results are returned in input order.
+        """
+        if len(questions) != len(format_hints):
+            raise ValueError("questions and format_hints must have the same length")
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def run_one(question: str, format_hint: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.arun(question, format_hint)
+
+        return list(await asyncio.gather(*(
+            run_one(question, format_hint)
+            for question, format_hint in zip(questions, format_hints)
+        )))
+
+    async def arun(self, question: str, format_hint: str) -> Dict[str, Any]:
+        """Run the agent on a question (async; nodes overlap blocking work)"""
         initial_state = {
             "question": question,
             "format_hint": format_hint,
             "route": None,
-            "retrieved_docs": [],
+            "retrieved_docs": _empty_docs(),
             "doc_chunk_ids": [],
             "constraints": {},
             "sql_query": None,
@@ -420,7 +664,11 @@ class HybridAgent:
             "trace": []
         }
 
-        final_state = self.graph.invoke(initial_state)
+        token = _DSPY_OVERRIDES.set(_current_dspy_overrides())
+        try:
+            final_state = await self.graph.ainvoke(initial_state)
+        finally:
+            _DSPY_OVERRIDES.reset(token)
 
         return {
             "final_answer": final_state["final_answer"],
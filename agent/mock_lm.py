@@ -3,45 +3,51 @@ Mock LM for testing without Ollama
 Generates simple rule-based SQL queries
 """
 import dspy
+from typing import NamedTuple, Tuple, Union
 
+# A keyword, or a tuple of alternative keywords (any one of them matches)
+Keywords = Tuple[Union[str, Tuple[str, ...]], ...]
 
-class MockLM(dspy.LM):
-    """Mock language model for testing"""
 
-    def __init__(self):
-        super().__init__(model="mock")
+class Rule(NamedTuple):
+    """Canned response for prompts containing every entry of `all_of`"""
+    all_of: Keywords
+    response: str
+    also: Keywords = ()  # required too, else the section fallback is returned
 
-    def __call__(self, prompt=None, messages=None, **kwargs):
-        """Generate mock responses based on keywords in prompt"""
-        if messages:
-            prompt = str(messages)
-        elif not prompt:
-            prompt = ""
 
-        prompt_lower = prompt.lower()
+class Section(NamedTuple):
+    """Group of rules for one kind of call (router, NL→SQL, ...)"""
+    name: str
+    all_of: Keywords
+    rules: Tuple[Rule, ...]
+    fallback: str
+
+
+def _matches(keywords: Keywords, text: str) -> bool:
+    """True if every entry (a keyword or a tuple of alternatives) occurs in text"""
+    return all(
+        entry in text if isinstance(entry, str) else any(keyword in text for keyword in entry)
+        for entry in keywords
+    )
 
-        # Router
-        if "classify" in prompt_lower or "route" in prompt_lower:
-            if "return" in prompt_lower and "policy" in prompt_lower:
-                return ['{"reasoning": "This is a RAG question about policies.", "route": "rag"}']
-            elif "revenue" in prompt_lower or "top" in prompt_lower:
-                return ['{"reasoning": "This needs both SQL and RAG.", "route": "hybrid"}']
-            else:
-                return ['{"reasoning": "Using hybrid approach.", "route": "hybrid"}']
-
-        # NL to SQL
-        if "generate" in prompt_lower and "sql" in prompt_lower:
-            if "top 3 products" in prompt_lower and "revenue" in prompt_lower:
-                sql = """SELECT p.ProductName, ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) AS Revenue
+
+def _message_text(message) -> str:
+    """Text of one chat message (dicts contribute their content only)"""
+    if not isinstance(message, dict):
+        return str(message)
+    content = message.get("content") or ""
+    return content if isinstance(content, str) else str(content)
+
+
+_TOP_PRODUCTS_SQL = """SELECT p.ProductName, ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) AS Revenue
 FROM Products p
 JOIN "Order Details" od ON p.ProductID = od.ProductID
 GROUP BY p.ProductName
 ORDER BY Revenue DESC
 LIMIT 3"""
-                return [sql]
 
-            elif "category" in prompt_lower and "quantity" in prompt_lower and "2013-06" in prompt_lower:
-                sql = """SELECT c.CategoryName, SUM(od.Quantity) AS TotalQuantity
+_CATEGORY_QUANTITY_SQL = """SELECT c.CategoryName, SUM(od.Quantity) AS TotalQuantity
 FROM Orders o
 JOIN "Order Details" od ON o.OrderID = od.OrderID
 JOIN Products p ON od.ProductID = p.ProductID
@@ -50,30 +56,21 @@ WHERE o.OrderDate BETWEEN '2013-06-01' AND '2013-06-30'
 GROUP BY c.CategoryName
 ORDER BY TotalQuantity DESC
 LIMIT 1"""
-                return [sql]
 
-            elif "aov" in prompt_lower or "average order value" in prompt_lower:
-                if "2013-12" in prompt_lower:
-                    sql = """SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID), 2) AS AOV
+_AOV_SQL = """SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) / COUNT(DISTINCT o.OrderID), 2) AS AOV
 FROM Orders o
 JOIN "Order Details" od ON o.OrderID = od.OrderID
 WHERE o.OrderDate BETWEEN '2013-12-01' AND '2013-12-31'"""
-                    return [sql]
 
-            elif "beverages" in prompt_lower and "revenue" in prompt_lower:
-                if "2013-06" in prompt_lower:
-                    sql = """SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) AS Revenue
+_BEVERAGES_REVENUE_SQL = """SELECT ROUND(SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)), 2) AS Revenue
 FROM Orders o
 JOIN "Order Details" od ON o.OrderID = od.OrderID
 JOIN Products p ON od.ProductID = p.ProductID
 JOIN Categories c ON p.CategoryID = c.CategoryID
 WHERE o.OrderDate BETWEEN '2013-06-01' AND '2013-06-30'
 AND c.CategoryName = 'Beverages'"""
-                    return [sql]
 
-            elif "customer" in prompt_lower and "margin" in prompt_lower:
-                if "2013" in prompt_lower:
-                    sql = """SELECT c.CompanyName, ROUND(SUM((od.UnitPrice - 0.7 * od.UnitPrice) * od.Quantity * (1 - od.Discount)), 2) AS Margin
+_CUSTOMER_MARGIN_SQL = """SELECT c.CompanyName, ROUND(SUM((od.UnitPrice - 0.7 * od.UnitPrice) * od.Quantity * (1 - od.Discount)), 2) AS Margin
 FROM Customers c
 JOIN Orders o ON c.CustomerID = o.CustomerID
 JOIN "Order Details" od ON o.OrderID = od.OrderID
@@ -81,28 +78,77 @@ WHERE strftime('%Y', o.OrderDate) = '2013'
 GROUP BY c.CompanyName
 ORDER BY Margin DESC
 LIMIT 1"""
-                    return [sql]
-
-            # Generic fallback
-            return ["SELECT * FROM Orders LIMIT 1"]
-
-        # Synthesizer
-        if "synthesize" in prompt_lower or "final answer" in prompt_lower:
-            if "int" in prompt_lower:
-                return ["14"]
-            elif "float" in prompt_lower:
-                return ["1234.56"]
-            else:
-                return ["Answer based on the data"]
-
-        # Planner/constraints
-        if "extract" in prompt_lower and "constraints" in prompt_lower:
-            if "2013-06" in prompt_lower or "summer" in prompt_lower:
-                return ['{"date_range": {"start": "2013-06-01", "end": "2013-06-30"}, "categories": ["Beverages"]}']
-            elif "2013-12" in prompt_lower or "winter" in prompt_lower:
-                return ['{"date_range": {"start": "2013-12-01", "end": "2013-12-31"}}']
-            else:
-                return ['{}']
+
+
+class MockLM(dspy.LM):
+    """Mock language model for testing"""
+
+    # Sections are checked in order; the first whose trigger matches answers.
+    # Within it, the first rule whose `all_of` matches decides: its response if
+    # `also` matches too, otherwise the section fallback.
+    _SECTIONS = (
+        Section(
+            name="router",
+            all_of=(("classify", "route"),),
+            rules=(
+                Rule(all_of=("return", "policy"), response='{"reasoning": "This is a RAG question about policies.", "route": "rag"}'),
+                Rule(all_of=(("revenue", "top"),), response='{"reasoning": "This needs both SQL and RAG.", "route": "hybrid"}'),
+            ),
+            fallback='{"reasoning": "Using hybrid approach.", "route": "hybrid"}',
+        ),
+        Section(
+            name="nl_to_sql",
+            all_of=("generate", "sql"),
+            rules=(
+                Rule(all_of=("top 3 products", "revenue"), response=_TOP_PRODUCTS_SQL),
+                Rule(all_of=("category", "quantity", "2013-06"), response=_CATEGORY_QUANTITY_SQL),
+                Rule(all_of=(("aov", "average order value"),), also=("2013-12",), response=_AOV_SQL),
+                Rule(all_of=("beverages", "revenue"), also=("2013-06",), response=_BEVERAGES_REVENUE_SQL),
+                Rule(all_of=("customer", "margin"), also=("2013",), response=_CUSTOMER_MARGIN_SQL),
+            ),
+            fallback="SELECT * FROM Orders LIMIT 1",  # Generic fallback
+        ),
+        Section(
+            name="synthesizer",
+            all_of=(("synthesize", "final answer"),),
+            rules=(
+                Rule(all_of=("int",), response="14"),
+                Rule(all_of=("float",), response="1234.56"),
+            ),
+            fallback="Answer based on the data",
+        ),
+        Section(
+            name="planner",
+            all_of=("extract", "constraints"),
+            rules=(
+                Rule(all_of=(("2013-06", "summer"),), response='{"date_range": {"start": "2013-06-01", "end": "2013-06-30"}, "categories": ["Beverages"]}'),
+                Rule(all_of=(("2013-12", "winter"),), response='{"date_range": {"start": "2013-12-01", "end": "2013-12-31"}}'),
+            ),
+            fallback='{}',
+        ),
+    )
+
+    def __init__(self):
+        super().__init__(model="mock")
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        """Generate mock responses based on keywords in prompt"""
+        if messages:
+            # Only message text matters; str(messages) would also scan dict repr noise
+            prompt = "\n".join(_message_text(message) for message in messages)
+        elif not prompt:
+            prompt = ""
+
+        prompt_lower = prompt.lower()
+
+        for section in self._SECTIONS:
+            if not _matches(section.all_of, prompt_lower):
+                continue
+            for rule in section.rules:
+                if _matches(rule.all_of, prompt_lower):
+                    # A rule that claims the prompt but lacks its extra keywords falls back
+                    return [rule.response if _matches(rule.also, prompt_lower) else section.fallback]
+            return [section.fallback]
 
         # Default
         return ["OK"]
@@ -1,17 +1,57 @@
 """
 TF-IDF based retrieval system for document corpus
 """
+import copy
+import hashlib
 import os
-import re
+import pickle
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import List, Dict, Optional, Tuple
 import numpy as np
 
+# sklearn/scipy are imported where first needed, so importing this module
+# (e.g. via the agent package on SQL-only paths) doesn't pay for them
+
+# Version of the cached index; bump whenever chunking (_split_sections,
+# _process_file) or Document changes, so stale chunks aren't served
+_CACHE_FORMAT = 1
+
+
+def _is_header(line: str) -> bool:
+    """`# ` / `## ` header line (whitespace after the hashes, incl. end of line)"""
+    if line[:1] != "#":
+        return False
+    rest = line[2:] if line[1:2] == "#" else line[1:]
+    return rest[:1].isspace()
+
+
+def _split_sections(content: str) -> List[str]:
+    """
+    Split markdown before every `#` / `##` header line, in one pass over lines
+
+    Same result as re.split(r'\n(?=##?\s)', content): the newline before a
+    header is dropped and a header on the first line starts the first section.
+    """
+    lines = content.split("\n")
+    last = len(lines) - 1
+    sections = []
+    current = [lines[0]]
+    for i in range(1, len(lines)):
+        line = lines[i]
+        # A line's own newline counts as the whitespace after its hashes
+        if _is_header(line if i == last else line + "\n"):
+            sections.append("\n".join(current))
+            current = []
+        current.append(line)
+    sections.append("\n".join(current))
+    return sections
+
 
 class Document:
     """Represents a document chunk with metadata"""
+    __slots__ = ("chunk_id", "content", "source", "score")
+
     def __init__(self, chunk_id: str, content: str, source: str, score: float = 0.0):
         self.chunk_id = chunk_id
         self.content = content
@@ -30,25 +70,55 @@ class Document:
 class TFIDFRetriever:
     """TF-IDF based document retriever"""
 
-    def __init__(self, docs_dir: str = "docs"):
+    def __init__(self, docs_dir: str = "docs", cache_dir: Optional[str] = ".rag_cache"):
         self.docs_dir = Path(docs_dir)
+        # Fitted index is cached here keyed on the docs' names/mtimes (None disables).
+        # Entries are unpickled, so only use a directory you trust
+        self.cache_dir = Path(cache_dir) if cache_dir else None
         self.chunks: List[Document] = []
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
         self.vectorizer = TfidfVectorizer(
             lowercase=True,
             stop_words='english',
             ngram_range=(1, 2),
-            max_features=1000
+            max_features=1000,
+            norm='l2',  # unit rows: retrieve() relies on this for cosine
+            dtype=np.float32  # CSR doc/query vectors at half the memory traffic
         )
         self.doc_vectors = None
         self._load_and_chunk_documents()
 
+        # Sorted CSR rows, plus a CSR copy of the transpose so each query is a
+        # single row-vector x matrix product with no per-query transpose
+        self.doc_vectors = self.doc_vectors.tocsr()
+        self.doc_vectors.sort_indices()
+        self._doc_vectors_T = self.doc_vectors.T.tocsr()
+        self._doc_vectors_T.sort_indices()
+
+        # chunk_id -> chunk, for O(1) lookups
+        self._chunk_index: Dict[str, Document] = {chunk.chunk_id: chunk for chunk in self.chunks}
+
     def _load_and_chunk_documents(self):
         """Load all markdown files and split into chunks"""
         if not self.docs_dir.exists():
             raise ValueError(f"Documents directory not found: {self.docs_dir}")
 
-        for filepath in self.docs_dir.glob("*.md"):
-            self._process_file(filepath)
+        # One directory read; DirEntry caches the file type
+        with os.scandir(self.docs_dir) as entries:
+            filepaths = [
+                Path(entry.path) for entry in entries
+                if entry.name.endswith(".md") and entry.is_file()
+            ]
+
+        cache_key = self._cache_key(filepaths) if self.cache_dir else None
+        if cache_key and self._load_cache(cache_key):
+            return
+
+        # Reads release the GIL, so overlap them; map() keeps file order
+        with ThreadPoolExecutor(max_workers=min(8, len(filepaths) or 1)) as executor:
+            for chunks in executor.map(self._process_file, filepaths):
+                self.chunks.extend(chunks)
 
         if not self.chunks:
             raise ValueError("No documents loaded")
@@ -57,17 +127,62 @@ class TFIDFRetriever:
         chunk_texts = [chunk.content for chunk in self.chunks]
         self.doc_vectors = self.vectorizer.fit_transform(chunk_texts)
 
-    def _process_file(self, filepath: Path):
-        """Process a single markdown file into chunks"""
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
+        if cache_key:
+            self._save_cache(cache_key)
+
+    def _cache_key(self, filepaths: List[Path]) -> str:
+        """Hash of the cache format, doc files (name, mtime, size) and vectorizer settings"""
+        stats = sorted(
+            (path.name, path.stat().st_mtime_ns, path.stat().st_size)
+            for path in filepaths
+        )
+        params = sorted(self.vectorizer.get_params().items())
+        return hashlib.sha256(repr((_CACHE_FORMAT, stats, params)).encode("utf-8")).hexdigest()[:16]
+
+    def _load_cache(self, key: str) -> bool:
+        """Restore vectorizer, chunks and doc vectors from the cache if present"""
+        meta_path = self.cache_dir / f"{key}.pkl"
+        vectors_path = self.cache_dir / f"{key}.npz"
+        if not (meta_path.exists() and vectors_path.exists()):
+            return False
+
+        from scipy import sparse
+
+        try:
+            with open(meta_path, 'rb') as f:
+                vectorizer, chunks = pickle.load(f)
+            doc_vectors = sparse.load_npz(vectors_path).tocsr()
+        except Exception:
+            # Corrupt or incompatible cache entry; rebuild
+            return False
+
+        self.vectorizer = vectorizer
+        self.chunks = chunks
+        self.doc_vectors = doc_vectors
+        return True
+
+    def _save_cache(self, key: str):
+        """Write the fitted index to the cache (best effort)"""
+        from scipy import sparse
+
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            sparse.save_npz(self.cache_dir / f"{key}.npz", self.doc_vectors)
+            with open(self.cache_dir / f"{key}.pkl", 'wb') as f:
+                pickle.dump((self.vectorizer, self.chunks), f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+
+    def _process_file(self, filepath: Path) -> List[Document]:
+        """Process a single markdown file into chunks (no shared state touched)"""
+        content = filepath.read_text(encoding='utf-8')
 
         source = filepath.stem
 
-        # Split by headers or paragraphs
-        # First try to split by headers (##)
-        sections = re.split(r'\n(?=##?\s)', content)
+        # Split by headers (# / ##)
+        sections = _split_sections(content)
 
+        chunks = []
         for idx, section in enumerate(sections):
             section = section.strip()
             if not section:
@@ -82,7 +197,9 @@ class TFIDFRetriever:
                 content=section,
                 source=source
             )
-            self.chunks.append(chunk)
+            chunks.append(chunk)
+
+        return chunks
 
     def retrieve(self, query: str, top_k: int = 3) -> List[Document]:
         """Retrieve top-k most relevant chunks for the query"""
@@ -92,30 +209,27 @@ class TFIDFRetriever:
         # Vectorize query
         query_vector = self.vectorizer.transform([query])
 
-        # Compute similarities
-        similarities = cosine_similarity(query_vector, self.doc_vectors)[0]
+        # Compute similarities: TF-IDF rows are L2-normalized (norm='l2'),
+        # so cosine similarity is a single sparse dot product
+        similarities = (query_vector @ self._doc_vectors_T).toarray().ravel()
 
-        # Get top-k indices
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        # Get top-k indices: partition in O(N), then sort only those k
+        k = min(top_k, similarities.shape[0])
+        if k <= 0:
+            return []
+        part = np.argpartition(-similarities, k - 1)[:k]
+        top_indices = part[np.argsort(-similarities[part])]
 
         # Create result documents with scores
         results = []
         for idx in top_indices:
-            chunk = self.chunks[idx]
-            score = float(similarities[idx])
-            result = Document(
-                chunk_id=chunk.chunk_id,
-                content=chunk.content,
-                source=chunk.source,
-                score=score
-            )
+            # Shallow copy so the indexed chunk keeps its score of 0.0
+            result = copy.copy(self.chunks[idx])
+            result.score = float(similarities[idx])
             results.append(result)
 
         return results
 
-    def get_chunk_by_id(self, chunk_id: str) -> Document:
+    def get_chunk_by_id(self, chunk_id: str) -> Optional[Document]:
         """Get a specific chunk by ID"""
-        for chunk in self.chunks:
-            if chunk.chunk_id == chunk_id:
-                return chunk
-        return None
+        return self._chunk_index.get(chunk_id)
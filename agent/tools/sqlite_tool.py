@@ -1,32 +1,129 @@
 """
 SQLite database tools for Northwind database
 """
+import re
 import sqlite3
+import threading
+import weakref
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Tuple, Any, Optional
 
 
+# Common table names in Northwind (and the lowercase variant schema)
+_TABLE_RE = re.compile(
+    r'\b(Order\s+Details|order_items|Orders|Products|Customers|Employees|Categories|Suppliers|Shippers)\b',
+    re.IGNORECASE
+)
+_TABLE_CANON = {
+    "order details": "Order Details",
+    "order_items": "Order Details",
+    "orders": "Orders",
+    "products": "Products",
+    "customers": "Customers",
+    "employees": "Employees",
+    "categories": "Categories",
+    "suppliers": "Suppliers",
+    "shippers": "Shippers",
+}
+
+
+class _ThreadConnection:
+    """Holds one thread's connection; closed when the thread's locals are dropped"""
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        weakref.finalize(self, conn.close)
+
+
 class SQLiteTool:
     """Tool for interacting with Northwind SQLite database"""
 
-    def __init__(self, db_path: str = "data/northwind.sqlite"):
+    # Tables surfaced to the LLM (schema digest, prompt hints)
+    KEY_TABLES = ("Categories", "Products", "Order Details", "Orders", "Customers")
+
+    # Per-connection tuning: 128 MiB page cache (the key tables fit), in-memory
+    # temp tables, 1 GiB mmap, and no fsync per commit under WAL
+    _PRAGMAS = (
+        "PRAGMA cache_size=-131072",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=1073741824",
+        "PRAGMA synchronous=NORMAL",
+    )
+
+    # Opt-in database setup: WAL and indexes for the common joins and date
+    # filters. This permanently changes the file (journal mode, indexes,
+    # -wal/-shm files alongside it)
+    _SETUP = (
+        "PRAGMA journal_mode=WAL",
+        'CREATE INDEX IF NOT EXISTS idx_od_order ON "Order Details"(OrderID)',
+        'CREATE INDEX IF NOT EXISTS idx_od_prod ON "Order Details"(ProductID)',
+        "CREATE INDEX IF NOT EXISTS idx_o_date ON Orders(OrderDate)",
+    )
+
+    def __init__(self, db_path: str = "data/northwind.sqlite", prepare_database: bool = False):
         self.db_path = Path(db_path)
         if not self.db_path.exists():
             raise ValueError(f"Database not found: {self.db_path}")
-        self._schema_cache = None  # Always regenerate schema to pick up changes
+        # (schema_version, schema); rebuilt when the schema changes. schema_version
+        # is used rather than the file mtime, which WAL commits don't touch
+        self._schema_cache = None
 
-    def get_connection(self):
-        """Get a connection to the database"""
-        return sqlite3.connect(self.db_path)
+        # One persistent connection per thread (agent nodes run on worker threads).
+        # Only the thread-local holds it strongly, so it is closed when its
+        # thread exits; the WeakSet lets close() reach the live ones
+        self._local = threading.local()
+        self._connections: "weakref.WeakSet[_ThreadConnection]" = weakref.WeakSet()
+        self._connections_lock = threading.Lock()
 
-    def get_schema(self) -> str:
-        """Get compact database schema with JOIN examples"""
+        # (query, schema_version) -> validate_query result
+        self._validated = lru_cache(maxsize=128)(self._explain)
+
+        if prepare_database:
+            self._prepare_database()
+
+    def _prepare_database(self):
+        """Apply the one-time setup statements (best effort, e.g. read-only files)"""
         conn = self.get_connection()
-        cursor = conn.cursor()
+        for statement in self._SETUP:
+            try:
+                conn.execute(statement)
+            except sqlite3.Error:
+                pass
+        conn.commit()
+
+    def _schema_version(self) -> int:
+        """SQLite's schema cookie; bumped by every committed DDL change"""
+        return self.get_connection().execute("PRAGMA schema_version").fetchone()[0]
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Get this thread's connection to the database (opened on first use)"""
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            for pragma in self._PRAGMAS:
+                conn.execute(pragma)
+            holder = self._local.holder = _ThreadConnection(conn)
+            with self._connections_lock:
+                self._connections.add(holder)
+        return holder.conn
+
+    def close(self):
+        """Close every live connection opened by this tool"""
+        with self._connections_lock:
+            holders = list(self._connections)
+            self._connections = weakref.WeakSet()
+            self._local = threading.local()
+        for holder in holders:
+            holder.conn.close()
 
-        # Get all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';")
-        tables = [row[0] for row in cursor.fetchall()]
+    def get_schema(self) -> str:
+        """Get compact database schema with JOIN examples"""
+        version = self._schema_version()
+        if self._schema_cache and self._schema_cache[0] == version:
+            return self._schema_cache[1]
 
         schema_lines = [
             "Important tables: Categories, Products, \"Order Details\", Orders, Customers",
@@ -38,58 +135,86 @@ class SQLiteTool:
             "JOIN path: Categories->Products->\"Order Details\"->Orders->Customers"
         ]
 
-        # Only show key tables
-        key_tables = ["Categories", "Products", "Order Details", "Orders", "Customers"]
-        for table in tables:
-            if table not in key_tables:
-                continue
-
-            cursor.execute(f"PRAGMA table_info([{table}]);")
-            columns = cursor.fetchall()
+        # Only show key tables: their first 3 columns and FKs between them,
+        # fetched for all tables in one statement via the pragma table functions
+        key_tables = self.KEY_TABLES
+        placeholders = ", ".join("?" * len(key_tables))
+        cursor = self.get_connection().cursor()
+        cursor.execute(
+            f"""
+            SELECT m.name, 0, ti.name, NULL, NULL
+            FROM sqlite_master m JOIN pragma_table_info(m.name) ti
+            WHERE m.type = 'table' AND m.name IN ({placeholders}) AND ti.cid < 3
+            UNION ALL
+            SELECT m.name, 1, fk."from", fk."table", fk."to"
+            FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) fk
+            WHERE m.type = 'table' AND m.name IN ({placeholders}) AND fk."table" IN ({placeholders})
+            """,
+            key_tables * 3
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+
+        # table -> column names / FK hint lines, in sqlite_master order
+        columns: Dict[str, List[str]] = {}
+        fk_lines: Dict[str, List[str]] = {}
+        for table, is_fk, from_col, ref_table, to_col in rows:
+            if is_fk:
+                ref_name = f'"{ref_table}"' if ' ' in ref_table else ref_table
+                fk_lines.setdefault(table, []).append(f"  {from_col}->{ref_name}.{to_col}")
+            else:
+                columns.setdefault(table, []).append(from_col)
 
+        for table, cols in columns.items():
             # Quote table name if it has spaces
             table_name = f'"{table}"' if ' ' in table else table
-
-            # Only show 3 key columns
-            cols = []
-            for col in columns[:3]:
-                col_id, name, col_type, not_null, default, pk = col
-                cols.append(name)
-
             schema_lines.append(f"{table_name}({', '.join(cols)}...)")
 
             # Add JOIN hints for FKs
-            cursor.execute(f"PRAGMA foreign_key_list([{table}]);")
-            fks = cursor.fetchall()
-            for fk in fks:
-                _, _, ref_table, from_col, to_col, _, _, _ = fk
-                if ref_table in key_tables:
-                    ref_name = f'"{ref_table}"' if ' ' in ref_table else ref_table
-                    schema_lines.append(f"  {from_col}->{ref_name}.{to_col}")
+            schema_lines.extend(fk_lines.get(table, ()))
 
-        conn.close()
+        schema = "\n".join(schema_lines)
+        self._schema_cache = (version, schema)
+        return schema
 
-        return "\n".join(schema_lines)
+    def table_summary(self) -> str:
+        """Comma-separated key tables present in the database (quoted if needed)"""
+        conn = self.get_connection()
+        present = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        return ", ".join(
+            f'"{table}"' if ' ' in table else table
+            for table in self.KEY_TABLES
+            if table in present
+        )
 
     def execute_query(
         self,
         query: str,
-        params: Optional[Tuple] = None
+        params: Optional[Tuple] = None,
+        max_rows: int = 1000,
+        columnar: bool = False
     ) -> Dict[str, Any]:
         """
         Execute a SQL query and return results with metadata
 
+        At most `max_rows` rows are fetched; `truncated` flags a capped result.
+        With `columnar=True` the rows are also returned column-wise as numpy
+        arrays under `columns_data` ({column: array}).
+
         Returns:
-            Dict with keys: success, data, columns, error, tables_used
+            Dict with keys: success, data, columns, error, tables_used, truncated
+            (+ columns_data when columnar)
         """
         result = {
             "success": False,
             "data": [],
             "columns": [],
             "error": None,
-            "tables_used": []
+            "tables_used": [],
+            "truncated": False
         }
 
+        conn = None
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
@@ -103,63 +228,96 @@ class SQLiteTool:
             if cursor.description:
                 result["columns"] = [desc[0] for desc in cursor.description]
 
-            # Get data
-            result["data"] = cursor.fetchall()
+            # Get data, in batches, up to max_rows
+            cursor.arraysize = 256
+            rows = []
+            while True:
+                batch = cursor.fetchmany()
+                if not batch:
+                    break
+                rows.extend(batch)
+                if len(rows) >= max_rows:
+                    result["truncated"] = len(rows) > max_rows or bool(cursor.fetchone())
+                    del rows[max_rows:]
+                    break
+            result["data"] = rows
+
+            if columnar:
+                import numpy as np  # only needed for the columnar view
+
+                column_values = zip(*rows) if rows else ([] for _ in result["columns"])
+                result["columns_data"] = {
+                    name: np.array(values)
+                    for name, values in zip(result["columns"], column_values)
+                }
             result["success"] = True
 
             # Extract tables used from query
             result["tables_used"] = self._extract_tables_from_query(query)
 
-            conn.close()
+            cursor.close()
 
         except Exception as e:
             result["error"] = str(e)
             result["success"] = False
 
+        finally:
+            # Connections persist across calls, so discard any write the query
+            # started (closing a per-call connection used to do this)
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+
         return result
 
     def _extract_tables_from_query(self, query: str) -> List[str]:
-        """Extract table names from SQL query"""
-        query_upper = query.upper()
-        tables = []
-
-        # Common table names in Northwind
-        known_tables = [
-            "Orders", "Order Details", "Products", "Customers",
-            "Employees", "Categories", "Suppliers", "Shippers",
-            "orders", "order_items", "products", "customers"
-        ]
-
-        for table in known_tables:
-            # Check if table name appears in query
-            if table.upper() in query_upper:
-                # Avoid duplicates
-                canonical = table if table[0].isupper() else table.capitalize()
-                if "Order Details" in query or "order_items" in query.lower():
-                    if "Order Details" not in tables:
-                        tables.append("Order Details")
-                elif canonical not in tables and canonical != "Order Details":
-                    tables.append(canonical)
-
-        return list(set(tables))
+        """Extract table names from SQL query (first-seen order)"""
+        return list(dict.fromkeys(
+            _TABLE_CANON[" ".join(name.lower().split())]
+            for name in _TABLE_RE.findall(query)
+        ))
 
     def validate_query(self, query: str) -> Tuple[bool, Optional[str]]:
         """
         Validate a SQL query without executing it
 
+        Results are memoized per (query, schema version), since regenerated
+        and repaired SQL often repeats.
+
         Returns:
             (is_valid, error_message)
         """
+        return self._validated(query, self._schema_version())
+
+    def _explain(self, query: str, schema_version: int) -> Tuple[bool, Optional[str]]:
+        """Compile the query with EXPLAIN on this thread's connection"""
+        if not sqlite3.complete_statement(query + "\n;"):
+            return False, "incomplete input"
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
             # Use EXPLAIN to validate without executing
-            cursor.execute(f"EXPLAIN {query}")
-            conn.close()
+            self.get_connection().execute(f"EXPLAIN {query}").close()
             return True, None
         except Exception as e:
             return False, str(e)
 
+    def clone_schema(self) -> sqlite3.Connection:
+        """
+        Copy the database's DDL (no rows) into a fresh in-memory connection
+
+        Useful for EXPLAIN-validating queries without touching the real file.
+        The connection may be shared across threads; callers must serialize use.
+        """
+        conn = self.get_connection()
+        ddl = conn.execute(
+            "SELECT sql FROM sqlite_master "
+            "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END"
+        ).fetchall()
+
+        schema_db = sqlite3.connect(":memory:", check_same_thread=False)
+        for (statement,) in ddl:
+            schema_db.execute(statement)
+        return schema_db
+
     def get_table_sample(self, table_name: str, limit: int = 5) -> Dict[str, Any]:
         """Get sample rows from a table"""
         query = f"SELECT * FROM {table_name} LIMIT {limit}"